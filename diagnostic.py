@@ -69,6 +69,7 @@ class ServiceDiagnostic:
         
         try:
             from src.services.llm import check_vllm_health, test_vllm_simple
+            from src.services.circuit_breaker import vllm_breaker
             
             # Проверяем health endpoint
             health_info = await check_vllm_health()
@@ -84,6 +85,12 @@ class ServiceDiagnostic:
             print("   Тестирование генерации...")
             answer = await test_vllm_simple()
             
+            breaker = vllm_breaker.stats()
+            print(f"   Circuit breaker: {breaker['state']}, ошибок {breaker['error_rate']:.0%} "
+                  f"из {breaker['window']}, открывался {breaker['opened']} раз")
+            for kind, latency in breaker['latency'].items():
+                print(f"   Задержка {kind}: p95 {latency['p95']:.2f}s, таймаут {latency['timeout']:.1f}s")
+            
             if "❌" in answer:
                 print(f"❌ vLLM вернул ошибку: {answer}")
                 return False
@@ -112,6 +119,8 @@ class ServiceDiagnostic:
                 print(f"✅ Эмбеддинги работают корректно")
                 print(f"   Модель: {result['model']}")
                 print(f"   Размер эмбеддинга: {result['embedding_size']}")
+                print(f"   Время загрузки модели: {result['load_time']:.1f}s")
+                print(f"   Память модели (RSS): +{result['rss_delta_mb']:.0f} MB")
                 return True
             else:
                 print(f"❌ Ошибка эмбеддингов: {result['error']}")
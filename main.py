@@ -1,23 +1,96 @@
+import argparse
 import asyncio
 import logging
+import secrets
+import signal
 
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, BotCommandScopeDefault
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.bot import DefaultBotProperties
+from aiohttp import web
 
-from src.services.supabase_client import init_supabase
+from src.services.supabase_client import init_supabase, close_supabase
+from src.services.ingestion_queue import start_ingestion_queue, stop_ingestion_queue
+from src.services.llm import init_llm_client, close_llm_client
+from src.services.summarizer import start_summary_scheduler, stop_summary_scheduler
+from src.services.vector_db import embedding_model_manager
+from src.services.hot_window import warm_hot_window
+from src.services.metrics import start_metrics_server, stop_metrics_server
+from src.services.tracing import start_trace_exporter, stop_trace_exporter
 from src.handlers import basic, team_management, message_ingestion, qa_session
+from src.webhook import create_webhook_app
+from src.db.fsm_storage import create_fsm_storage
 from src.settings import settings
 
-async def main():
+# Keeps fire-and-forget startup tasks referenced until they finish
+_background_tasks = set()
+
+async def on_startup():
+    if settings.embedding_warmup:
+        embedding_model_manager.start_warmup()
+    # Recent history is loaded in the background, teams use the DB until theirs is in
+    task = asyncio.create_task(warm_hot_window(), name="hot-window-warmup")
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot)
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Serve updates over HTTP until SIGINT/SIGTERM, then drain in-flight updates"""
+    if not settings.webhook_url:
+        raise RuntimeError("WEBHOOK_URL must be set to run in webhook mode")
+    if settings.webhook_secret:
+        secret_token = settings.webhook_secret.get_secret_value()
+    else:
+        # Telegram gets the token from set_webhook below, so a random one works per run
+        secret_token = secrets.token_urlsafe(32)
+        logging.warning("⚠️ WEBHOOK_SECRET is not set, using a random secret token for this run")
+
+    app = create_webhook_app(
+        bot,
+        dp,
+        path=settings.webhook_path,
+        secret_token=secret_token,
+        shutdown_timeout=settings.webhook_shutdown_timeout
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C still raises KeyboardInterrupt
+            pass
+
+    try:
+        await bot.set_webhook(
+            url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logging.info(f"🌐 Webhook server listening on {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+        await stop.wait()
+    finally:
+        logging.info("🛑 Shutting down webhook server...")
+        # Runs the shutdown hooks: waits for handlers in flight and closes the bot session
+        await runner.cleanup()
+
+async def main(mode: str = "polling"):
     # Bot and Dispatcher setup
     logging.basicConfig(level=logging.INFO)
     bot = Bot(
         token=settings.bot_token.get_secret_value(),
         default=DefaultBotProperties(parse_mode="HTML")
     )
-    dp = Dispatcher()
+    dp = Dispatcher(storage=create_fsm_storage())
 
     # Include routers
     dp.include_router(basic.router)
@@ -41,17 +114,41 @@ async def main():
 
     # Initialize external services
     init_supabase()
+    start_ingestion_queue()
+    init_llm_client()
+    start_summary_scheduler()
+    await start_metrics_server()
+    start_trace_exporter()
+
+    # Warm the embedding model up in the background once the bot has started
+    dp.startup.register(on_startup)
 
-    # Start polling
+    # Start receiving updates
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if mode == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
     finally:
+        await stop_metrics_server()
+        await stop_trace_exporter()
+        await stop_summary_scheduler()
+        await stop_ingestion_queue()
+        await close_llm_client()
         await bot.session.close()
+        close_supabase()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatCopilot Telegram bot")
+    parser.add_argument(
+        "--mode",
+        choices=["polling", "webhook"],
+        default=settings.bot_mode,
+        help="how to receive updates from Telegram (default: BOT_MODE or polling)"
+    )
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.mode))
     except (KeyboardInterrupt, SystemExit):
         logging.info("Bot stopped!")
@@ -0,0 +1,320 @@
+import json
+import logging
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from src.services.cache import TTLCache
+from src.services.metrics import retries_total
+from src.settings import settings
+
+
+def storage_key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class SQLiteFSMBackend:
+    """FSM rows in a local SQLite file in WAL mode, safe to share between processes of one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3 connections belong to one thread, so every call goes through the same one
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm_states ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_states_updated_at ON fsm_states(updated_at)")
+            self._conn.commit()
+        return self._conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"key": key, "state": row[0], "data": json.loads(row[1]), "updated_at": row[2]}
+
+    def _save(self, records: List[Dict[str, Any]]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                [
+                    (record["key"], record["state"], json.dumps(record["data"], ensure_ascii=False), record["updated_at"])
+                    for record in records
+                ],
+            )
+
+    def _delete(self, keys: List[str]):
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in keys])
+
+    def _purge(self, updated_before: float) -> int:
+        conn = self._connect()
+        with conn:
+            return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (updated_before,)).rowcount
+
+    async def load(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._load, key)
+
+    async def save(self, records: List[Dict[str, Any]]):
+        if records:
+            await self._run(self._save, records)
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self._run(self._delete, keys)
+
+    async def purge(self, updated_before: float):
+        await self._run(self._purge, updated_before)
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+        self._executor.shutdown(wait=True)
+
+
+class SupabaseFSMBackend:
+    """
+    FSM rows in the Supabase fsm_states table, shared by every bot instance:
+
+        CREATE TABLE fsm_states (
+          key TEXT PRIMARY KEY,
+          state TEXT,
+          data JSONB NOT NULL DEFAULT '{}',
+          updated_at DOUBLE PRECISION NOT NULL
+        );
+        CREATE INDEX fsm_states_updated_at ON fsm_states(updated_at);
+    """
+
+    async def load(self, key: str) -> Optional[Dict[str, Any]]:
+        from src.services.supabase_client import get_fsm_record
+        return await get_fsm_record(key)
+
+    async def save(self, records: List[Dict[str, Any]]):
+        from src.services.supabase_client import save_fsm_records
+        await save_fsm_records(records)
+
+    async def delete(self, keys: List[str]):
+        from src.services.supabase_client import delete_fsm_records
+        await delete_fsm_records(keys)
+
+    async def purge(self, updated_before: float):
+        from src.services.supabase_client import purge_fsm_records
+        await purge_fsm_records(updated_before)
+
+    async def close(self):
+        pass
+
+
+class PersistentFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage on top of a shared backend (SQLite or Supabase).
+
+    - Reads are cached in process for cache_ttl seconds, so a burst of
+      get_state/get_data calls within one update costs one backend read.
+    - Writes land in a pending map and are flushed in one batch every
+      flush_interval; several writes to one key in between become one row.
+      Reads see pending writes of this process immediately.
+    - Sessions not used for session_ttl are treated as empty and purged
+      from the backend periodically. The TTL slides: a read of a session older
+      than refresh_fraction of the TTL queues a write that renews updated_at,
+      so a chat that is only read (Q&A questions) stays alive while in use.
+
+    Other processes see a write after at most flush_interval, and a process
+    may serve a cached state for up to cache_ttl after another one changed it.
+    """
+
+    def __init__(
+        self,
+        backend,
+        cache_ttl: float = 2.0,
+        cache_max_size: int = 10000,
+        flush_interval: float = 0.05,
+        session_ttl: float = 86400,
+        purge_interval: float = 3600,
+        refresh_fraction: float = 0.1,
+    ):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl
+        self.refresh_fraction = refresh_fraction
+        self.purge_interval = purge_interval
+        self._cache = TTLCache(max_size=cache_max_size, ttl=cache_ttl)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+
+        self.reads = 0
+        self.writes = 0
+        self.flushed_rows = 0
+
+    # --- records -----------------------------------------------------------
+
+    def _expired(self, record: Dict[str, Any]) -> bool:
+        return self.session_ttl > 0 and time.time() - record["updated_at"] > self.session_ttl
+
+    async def _get_record(self, key: str) -> Dict[str, Any]:
+        record = self._pending.get(key)
+        if record is None:
+            record = self._cache.get(key)
+        if record is None:
+            self.reads += 1
+            record = await self.backend.load(key) or {"key": key, "state": None, "data": {}, "updated_at": time.time()}
+            self._cache.set(key, record)
+        if self._expired(record):
+            return {"key": key, "state": None, "data": {}, "updated_at": time.time()}
+        if (
+            self.session_ttl > 0
+            and (record["state"] is not None or record["data"])
+            and time.time() - record["updated_at"] > self.session_ttl * self.refresh_fraction
+        ):
+            # Reading counts as activity, renew the session in the next flush
+            await self._put_record(key, record["state"], record["data"])
+            return self._pending[key]
+        return record
+
+    async def _put_record(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        record = {"key": key, "state": state, "data": data, "updated_at": time.time()}
+        self._pending[key] = record
+        self._cache.set(key, record)
+        self.writes += 1
+        self._ensure_flusher()
+        self._wakeup.set()
+
+    # --- BaseStorage ---------------------------------------------------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = storage_key(key)
+        record = await self._get_record(name)
+        await self._put_record(name, state.state if isinstance(state, State) else state, record["data"])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(storage_key(key)))["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = storage_key(key)
+        record = await self._get_record(name)
+        await self._put_record(name, record["state"], data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(storage_key(key)))["data"].copy()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self._flush()
+        await self.backend.close()
+
+    # --- background flush ----------------------------------------------------
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._run(), name="fsm-storage-flush")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give the rest of the handler a moment to write to the same key
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logging.error(f"❌ Failed to flush FSM states, retrying: {e}")
+                retries_total.inc(operation="fsm_flush")
+                await asyncio.sleep(1)
+                self._wakeup.set()
+            if self.purge_interval > 0 and time.time() - self._last_purge > self.purge_interval:
+                await self._purge()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        # A cleared session (no state, no data) is deleted rather than stored
+        to_delete = [key for key, record in batch.items() if record["state"] is None and not record["data"]]
+        to_save = [record for record in batch.values() if record["state"] is not None or record["data"]]
+        try:
+            await self.backend.save(to_save)
+            await self.backend.delete(to_delete)
+        except Exception:
+            # Keep newer writes that arrived during the flush, requeue the rest
+            for key, record in batch.items():
+                self._pending.setdefault(key, record)
+            raise
+        self.flushed_rows += len(batch)
+
+    async def _purge(self):
+        self._last_purge = time.time()
+        if self.session_ttl <= 0:
+            return
+        try:
+            await self.backend.purge(time.time() - self.session_ttl)
+        except Exception as e:
+            logging.warning(f"⚠️ Failed to purge expired FSM states: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "reads": self.reads,
+            "writes": self.writes,
+            "flushed_rows": self.flushed_rows,
+            "pending": len(self._pending),
+            "cache": self._cache.stats(),
+        }
+
+
+def create_fsm_storage() -> BaseStorage:
+    """FSM storage selected by FSM_STORAGE: memory | sqlite | supabase"""
+    if settings.fsm_storage == "memory":
+        return MemoryStorage()
+    if settings.fsm_storage == "sqlite":
+        backend = SQLiteFSMBackend(settings.fsm_sqlite_path)
+    elif settings.fsm_storage == "supabase":
+        backend = SupabaseFSMBackend()
+    else:
+        raise ValueError(f"Unknown FSM storage '{settings.fsm_storage}', expected memory, sqlite or supabase")
+    logging.info(f"💾 FSM storage: {settings.fsm_storage}")
+    return PersistentFSMStorage(
+        backend,
+        cache_ttl=settings.fsm_cache_ttl,
+        flush_interval=settings.fsm_flush_interval_ms / 1000,
+        session_ttl=settings.fsm_session_ttl,
+    )
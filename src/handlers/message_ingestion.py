@@ -2,7 +2,10 @@ import logging
 from aiogram import Router, F
 from aiogram.types import Message
 
-from src.services.supabase_client import get_linked_chat, save_message
+from src.services.supabase_client import get_linked_chat
+from src.services.ingestion_queue import enqueue_message
+from src.services.answer_cache import answer_cache
+from src.services.hot_window import hot_window
 
 router = Router()
 
@@ -10,7 +13,7 @@ router = Router()
 async def message_handler(message: Message):
     """
     This handler catches all text messages in group chats,
-    checks if the chat is linked to a team, and saves the message to Supabase.
+    checks if the chat is linked to a team, and queues the message for a batched save to Supabase.
     """
     chat_id = message.chat.id
     chat_title = message.chat.title or "Unknown Chat"
@@ -27,10 +30,10 @@ async def message_handler(message: Message):
             logging.warning(f"Chat {chat_id} ({chat_title}) is linked but has no team_id. Ignoring.")
             return
             
-        logging.info(f"Chat {chat_id} is linked to team {team_id}. Saving message.")
+        logging.debug(f"Chat {chat_id} is linked to team {team_id}. Queueing message.")
 
-        # Save the message to Supabase
-        await save_message(
+        # Queue the message, it is written to Supabase in the next batch
+        await enqueue_message(
             team_id=team_id,
             chat_id=chat_id,
             message_id=message.message_id,
@@ -39,5 +42,18 @@ async def message_handler(message: Message):
             text=message.text
         )
 
+        # Recency questions are answered from the in-memory window
+        hot_window.add(
+            team_id,
+            chat_id=chat_id,
+            message_id=message.message_id,
+            user_name=message.from_user.full_name,
+            text=message.text,
+            ts=message.date.timestamp()
+        )
+
+        # Cached answers of this team may no longer reflect its history
+        answer_cache.invalidate_team(team_id)
+
     except Exception as e:
         logging.error(f"Error processing message in chat {chat_id}: {e}", exc_info=True)
\ No newline at end of file
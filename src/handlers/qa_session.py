@@ -1,15 +1,99 @@
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 from aiogram.filters import Command
+from typing import AsyncIterator, Tuple
+import asyncio
 import logging
 
 from src.states.team import ChatWithTeam
-from src.services.llm import get_answer
-from src.services.supabase_client import get_team_by_id, search_messages_by_text
+from src.services.llm import get_answer, stream_answer, StreamInterrupted, BUSY_REPLY, UNAVAILABLE_REPLY
+from src.services.context_packer import ensure_tokenizer, pack_snippets
+from src.services.answer_cache import answer_cache
+from src.services.supabase_client import get_team_by_id, get_recent_summaries
+from src.services.prompt_template import format_summaries
+from src.services.retrieval import hybrid_search, expand_with_neighbors, message_key
+from src.services.hot_window import hot_window, is_recency_question
+from src.services.metrics import chat_question_seconds
+from src.services.tracing import start_trace, span
+from src.settings import settings
 
 router = Router()
 
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Shown under an answer whose stream broke off midway
+INCOMPLETE_NOTE = "\n\n⚠️ Ответ оборвался: сервер ИИ прервал генерацию, текст неполный."
+
+async def send_streamed_answer(message: Message, chunks: AsyncIterator[str], footer: str) -> Tuple[str, bool]:
+    """
+    Sends the first chunk of the answer as soon as it arrives, then edits that
+    message with the accumulated text at most once per stream_edit_interval.
+    Returns the answer text (without the footer) and whether it is complete;
+    an interrupted answer is marked as such in the message.
+    """
+    loop = asyncio.get_running_loop()
+    answer = ""
+    sent = None
+    shown = ""
+    last_edit = 0.0
+    complete = True
+
+    try:
+        async for chunk in chunks:
+            answer += chunk
+            if sent is None:
+                shown = answer[:TELEGRAM_MESSAGE_LIMIT]
+                with span("telegram.send", chars=len(shown)):
+                    sent = await message.answer(shown, parse_mode=None)
+                last_edit = loop.time()
+            elif loop.time() - last_edit >= settings.stream_edit_interval:
+                preview = answer[:TELEGRAM_MESSAGE_LIMIT]
+                if preview != shown:
+                    try:
+                        # Partial text may contain unbalanced markup, so it is shown as plain text
+                        with span("telegram.edit", chars=len(preview)):
+                            await sent.edit_text(preview, parse_mode=None)
+                        shown = preview
+                    except (TelegramBadRequest, TelegramRetryAfter) as e:
+                        logging.debug(f"Skipped intermediate answer edit: {e}")
+                    last_edit = loop.time()
+    except StreamInterrupted:
+        complete = False
+        footer = INCOMPLETE_NOTE + footer
+
+    final_answer = answer + footer
+    if sent is None:
+        with span("telegram.send", chars=len(final_answer)):
+            await message.answer(final_answer)
+        return answer, complete
+    with span("telegram.edit", chars=len(final_answer), final=True):
+        await edit_final_answer(sent, final_answer)
+    return answer, complete
+
+
+async def edit_final_answer(sent: Message, text: str):
+    """
+    Replaces the streamed preview with the final answer. Unlike the intermediate
+    edits this one must not be skipped: after a flood-control error it waits
+    retry_after seconds and tries once more.
+    """
+    for attempt in range(2):
+        try:
+            try:
+                await sent.edit_text(text)
+            except TelegramBadRequest as e:
+                logging.warning(f"Final answer edit failed, retrying as plain text: {e}")
+                await sent.edit_text(text[:TELEGRAM_MESSAGE_LIMIT], parse_mode=None)
+            return
+        except TelegramRetryAfter as e:
+            if attempt:
+                raise
+            logging.warning(f"⏳ Final answer edit hit flood control, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+
+
 @router.callback_query(F.data.startswith("start_chat:"))
 async def start_chat_session(callback: CallbackQuery, state: FSMContext):
     """Handler to start a chat session with AI via callback from the /chat command."""
@@ -43,56 +127,148 @@ async def start_chat_session(callback: CallbackQuery, state: FSMContext):
 @router.message(ChatWithTeam.active, F.text & ~F.text.startswith("/"))
 async def handle_chat_question(message: Message, state: FSMContext, bot: Bot):
     """Handler for questions in AI chat mode."""
-    await bot.send_chat_action(message.chat.id, "typing")
-    
-    data = await state.get_data()
-    team_id = data.get("current_team_id")
+    handling_started = asyncio.get_running_loop().time()
     question = message.text
+    with start_trace("chat.question", user_id=message.from_user.id, question_chars=len(question)) as trace:
+        with span("telegram.chat_action"):
+            await bot.send_chat_action(message.chat.id, "typing")
 
-    if not team_id:
-        await message.answer("❌ **Ошибка сессии.** Пожалуйста, начните чат заново с помощью `/chat`.")
-        await state.clear()
-        return
-    
-    logging.info(f"🤖 Processing Q&A question from user {message.from_user.id} for team {team_id}: '{question[:50]}...'")
-    
+        with span("session.load"):
+            data = await state.get_data()
+        team_id = data.get("current_team_id")
+
+        if not team_id:
+            await message.answer("❌ **Ошибка сессии.** Пожалуйста, начните чат заново с помощью `/chat`.")
+            await state.clear()
+            return
+
+        if trace:
+            trace.root.set(team_id=team_id)
+        logging.info(f"🤖 Processing Q&A question from user {message.from_user.id} for team {team_id}: '{question[:50]}...'")
+        outcome = "error"
+        try:
+            outcome = await answer_question(message, team_id, question)
+        finally:
+            if trace:
+                trace.root.set(outcome=outcome)
+            chat_question_seconds.observe(asyncio.get_running_loop().time() - handling_started, outcome=outcome)
+
+async def answer_question(message: Message, team_id: str, question: str) -> str:
+    """
+    Finds the context, gets the answer and sends it. Every step is a span of
+    the current trace. Returns the outcome: answered, cached, interrupted,
+    busy, unavailable or error.
+    """
     try:
-        team_doc = await get_team_by_id(team_id)
+        with span("team.lookup"):
+            team_doc = await get_team_by_id(team_id)
         team_name = team_doc.get('name', 'Unknown')
         custom_system_message = team_doc.get("system_message")
 
         system_message = custom_system_message or "Ты — ChatCopilot, ИИ-ассистент для командной работы. Твоя задача — помогать пользователям, отвечая на их вопросы на основе предоставленной истории переписки из командных чатов."
 
-        # 1. Search for relevant messages in Supabase
-        logging.info(f"🔍 Searching for context for '{question[:30]}...' in team {team_id}")
-        relevant_messages = await search_messages_by_text(team_id, question, limit=7)
+        # 1-2. Recency questions are answered from the hot window, the rest
+        # search for relevant messages (full-text + vector) and expand every
+        # hit to the surrounding conversation
+        recent_messages = hot_window.lookup(team_id) if is_recency_question(question) else None
+        if recent_messages:
+            logging.info(f"🔥 Answering from the hot window of team {team_id} ({len(recent_messages)} messages)")
+            relevant_messages = recent_messages
+            # Newest message is the anchor, older ones are added while the budget allows
+            snippets = [{"chat_id": None, "messages": recent_messages, "hits": {message_key(recent_messages[-1])}}]
+        else:
+            logging.info(f"🔍 Searching for context for '{question[:30]}...' in team {team_id}")
+            with span("search") as step:
+                relevant_messages = await hybrid_search(team_id, question, limit=7)
+                if step:
+                    step.set(hits=len(relevant_messages))
+            with span("search.expand") as step:
+                snippets = await expand_with_neighbors(team_id, relevant_messages)
+                if step:
+                    step.set(snippets=len(snippets))
         
-        # 2. Build the context string
-        if relevant_messages:
-            context = "Найденная история сообщений для ответа на вопрос:\n---\n"
-            context += "\n".join([f"{msg['user_name']}: {msg['text']}" for msg in relevant_messages])
-            context += "\n---"
-            logging.info(f"📚 Found {len(relevant_messages)} relevant messages for context.")
+        # 3. Build the context string within the token budget
+        with span("context.build", hot_window=bool(recent_messages)) as step:
+            await ensure_tokenizer()
+            packed = pack_snippets(
+                snippets,
+                header="Найденная история сообщений для ответа на вопрос:\n---\n",
+                footer="\n---"
+            )
+            if step:
+                step.set(messages=len(packed["messages"]), tokens=packed["token_count"], truncated=packed["truncated"])
+        if packed["context"]:
+            context = packed["context"]
+            logging.info(
+                f"📚 Packed {len(packed['messages'])} messages in {packed['snippets']} snippets "
+                f"around {len(relevant_messages)} relevant messages into context "
+                f"({packed['token_count']} tokens, truncated={packed['truncated']}, "
+                f"duplicates={packed['duplicates']}, dropped={packed['dropped']})"
+            )
         else:
             context = "В истории команды не найдено релевантной информации по данному вопросу."
             logging.info("📚 No relevant messages found.")
 
-        # 3. Get the answer from vLLM
-        full_context = f"System Prompt: {system_message}\n\n{context}"
+        # 4. Get the answer from vLLM. The system message and the recent daily
+        # summaries go into the stable prompt prefix, ahead of the context
+        summaries = ""
+        if settings.prompt_summary_days > 0:
+            with span("summaries") as step:
+                summaries = format_summaries(await get_recent_summaries(team_id))
+                if step:
+                    step.set(chars=len(summaries))
+        cache_context = f"{system_message}\n\n{summaries}\n\n{context}"
         logging.info(f"🤖 Requesting answer from vLLM for team {team_id}")
-        answer = await get_answer(full_context, question)
-        
-        # 4. Send the final answer
         footer = f"\n---\n💬 Чат с командой «{team_name}» | `/cancel` для выхода"
-        final_answer = answer + footer
         
-        await message.answer(final_answer)
+        # 5. Reuse a cached answer if the team already asked this
+        with span("cache.lookup") as step:
+            cached_answer = await answer_cache.lookup(team_id, question, cache_context)
+            if step:
+                step.set(hit=bool(cached_answer))
+        if cached_answer:
+            logging.info(f"💾 Answer cache hit for team {team_id}")
+            with span("telegram.send", chars=len(cached_answer) + len(footer)):
+                await message.answer(cached_answer + footer)
+            return "cached"
+
+        # 6. Send the answer, streaming it when enabled
+        started = asyncio.get_running_loop().time()
+        prompt_parts = {"team_id": team_id, "system_message": system_message, "summaries": summaries}
+        if settings.vllm_streaming:
+            # Generation and sending overlap, the Telegram calls are spans inside this one
+            with span("llm.stream") as step:
+                answer, complete = await send_streamed_answer(
+                    message, stream_answer(context, question, **prompt_parts), footer
+                )
+                if step:
+                    step.set(answer_chars=len(answer), complete=complete)
+            if not complete:
+                # A cut-off answer must not be served to the next askers
+                logging.warning(f"⚠️ Answer for team {team_id} was interrupted, not caching it")
+                return "interrupted"
+        else:
+            with span("llm") as step:
+                answer = await get_answer(context, question, **prompt_parts)
+                if step:
+                    step.set(answer_chars=len(answer))
+            with span("telegram.send", chars=len(answer) + len(footer)):
+                await message.answer(answer + footer)
+        if answer.startswith("❌"):
+            # BUSY/UNAVAILABLE and other error replies are not answers
+            outcome = {BUSY_REPLY: "busy", UNAVAILABLE_REPLY: "unavailable"}.get(answer, "error")
+            logging.warning(f"⚠️ No answer for team {team_id}: {outcome}")
+            return outcome
+        generation_time = asyncio.get_running_loop().time() - started
+        await answer_cache.store(team_id, question, cache_context, answer, generation_time)
         
         logging.info(f"✅ Successfully answered question for user {message.from_user.id} in team {team_id}")
+        return "answered"
 
     except Exception as e:
         logging.error(f"❌ Error handling question for team {team_id}: {e}", exc_info=True)
         await message.answer("❌ **Ошибка при обработке вопроса.** Не удалось получить ответ от ИИ. Попробуйте позже.")
+        return "error"
 
 @router.message(ChatWithTeam.active, Command("cancel"))
 async def cancel_chat_session(message: Message, state: FSMContext):
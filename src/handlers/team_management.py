@@ -1,7 +1,9 @@
+import html
 import secrets
 import string
+import time
 from aiogram import Router, F, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ChatMemberUpdated, CallbackQuery
 
@@ -10,10 +12,15 @@ from src.keyboards.inline import select_team_keyboard, select_chat_team_keyboard
 from src.services.supabase_client import (
     create_team, create_user, get_team_by_invite_code, add_user_to_team, 
     get_user_teams, get_user_admin_teams, get_user_by_id, link_chat_to_team,
-    update_team_system_message
+    update_team_system_message, get_routing_cache_stats, get_team_cache_stats
 )
 # from src.services.vector_db import test_team_vector_creation, get_namespace_stats  # ОТКЛЮЧЕНО
-from src.handlers.message_ingestion import message_buffer
+from src.services.hot_window import hot_window
+from src.services.answer_cache import answer_cache
+from src.services.llm_scheduler import llm_scheduler
+from src.services.circuit_breaker import vllm_breaker
+from src.services.prompt_template import prefix_tracker
+from src.services.tracing import trace_store, Trace
 from src.settings import settings
 
 router = Router()
@@ -41,7 +48,8 @@ async def check_buffers_command(message: Message):
     
     result = "📊 **Состояние буферов сообщений:**\n\n"
     
-    if not message_buffer:
+    team_ids = hot_window.teams()
+    if not team_ids:
         result += "📭 Буферы пусты\n\n"
         result += "**Возможные причины:**\n"
         result += "• Бот недавно перезапущен\n"
@@ -53,28 +61,32 @@ async def check_buffers_command(message: Message):
         result += "• `/monitor_messages` - мониторинг в реальном времени\n"
         result += "• Убедитесь, что чаты привязаны (`/link_chat`)"
     else:
-        total_messages = sum(len(msgs) for msgs in message_buffer.values())
-        result += f"✅ Активных буферов: {len(message_buffer)}\n"
-        result += f"📝 Всего сообщений в буферах: {total_messages}\n\n"
-        
-        for team_id, messages in message_buffer.items():
+        stats = hot_window.stats()
+        result += f"✅ Активных буферов: {stats['teams']}\n"
+        result += f"📝 Всего сообщений в буферах: {stats['messages']}\n"
+        result += f"💾 Память: {stats['bytes'] / 1024:.0f} / {stats['max_bytes'] / 1024:.0f} KB\n"
+        result += f"🎯 Ответов из буфера/промахов: {stats['hits']}/{stats['misses']}, вытеснено: {stats['evictions']}\n\n"
+        
+        for team_id in team_ids:
+            messages = hot_window.recent(team_id)
             result += f"**Команда {team_id[:8]}...:**\n"
-            result += f"• Сообщений в буфере: {len(messages)}/5\n"
+            result += f"• Сообщений в буфере: {len(messages)}/{hot_window.max_messages}\n"
             
             if messages:
                 result += f"• Последние сообщения:\n"
                 for msg in messages[-2:]:  # Показать последние 2 сообщения
-                    preview = msg[:40] + "..." if len(msg) > 40 else msg
+                    text = msg['text']
+                    preview = text[:40] + "..." if len(text) > 40 else text
                     result += f"  - {preview}\n"
             result += "\n"
         
-        result += "💡 **Подсказка:** Буфер обрабатывается при накоплении 5 сообщений"
+        result += f"💡 **Подсказка:** Буфер хранит последние {settings.hot_window_hours:g} ч переписки для вопросов о недавнем"
     
     await message.answer(result, parse_mode="Markdown")
 
 @router.message(Command("force_process_buffers"))
 async def force_process_buffers_command(message: Message):
-    """Принудительно обработать все буферы (для админов)"""
+    """Принудительно проиндексировать сообщения буферов в векторном хранилище (для админов)"""
     
     user_id = message.from_user.id
     
@@ -86,41 +98,25 @@ async def force_process_buffers_command(message: Message):
             await message.answer("❌ У вас нет прав администратора команд.")
             return
         
-        if not message_buffer:
+        team_ids = hot_window.teams()
+        if not team_ids:
             await message.answer("📭 Буферы пусты - нечего обрабатывать.")
             return
         
         await message.answer("🔄 Запуск принудительной обработки буферов...")
         
+        from src.services.vector_db import index_messages
+        
         processed_count = 0
-        for team_id, messages in list(message_buffer.items()):
+        for team_id in team_ids:
+            messages = hot_window.recent(team_id)
             if messages:  # Если есть сообщения
                 try:
-                    # Принудительная обработка любого количества сообщений
-                    chunk_text = "\n".join(messages)
-                    
-                    if len(chunk_text.strip()) == 0:
-                        continue
-                    
-                    # Импортируем необходимые функции
-                    from src.services.vector_db import get_embedding, upsert_vector
-                    import uuid
-                    
-                    # Создаем эмбеддинг
-                    vector = await get_embedding(chunk_text)
-                    
-                    # Сохраняем в Pinecone
-                    vector_id = str(uuid.uuid4())
-                    upsert_vector(vector_id, vector, team_id, chunk_text)
-                    
-                    # Очищаем буфер
-                    message_buffer[team_id] = []
+                    # Повторная индексация заменяет векторы тех же сообщений
+                    indexed = await index_messages([dict(msg, team_id=team_id) for msg in messages])
                     
                     processed_count += 1
-                    await message.answer(
-                        f"✅ Команда {team_id[:8]}...: обработано {len(messages)} сообщений\n"
-                        f"📄 Создан вектор: {vector_id[:8]}..."
-                    )
+                    await message.answer(f"✅ Команда {team_id[:8]}...: проиндексировано {indexed} сообщений")
                     
                 except Exception as e:
                     await message.answer(f"❌ Ошибка обработки команды {team_id}: {e}")
@@ -176,10 +172,10 @@ async def debug_system_command(message: Message):
     
     # 3. Check message buffers
     result += "\n**3. Буферы сообщений:**\n"
-    if message_buffer:
-        result += f"✅ Активных буферов: {len(message_buffer)}\n"
-        for team_id, messages in message_buffer.items():
-            result += f"  • Team {team_id}: {len(messages)} сообщений\n"
+    if hot_window.teams():
+        result += f"✅ Активных буферов: {len(hot_window.teams())}\n"
+        for team_id in hot_window.teams():
+            result += f"  • Team {team_id}: {len(hot_window.recent(team_id))} сообщений\n"
     else:
         result += "⚠️ Буферы пусты (нормально, если недавно перезапустили)\n"
     
@@ -201,16 +197,16 @@ async def debug_system_command(message: Message):
     except Exception as e:
         result += f"❌ Ошибка проверки команд: {e}\n"
     
-    # 5. Test Pinecone connection
-    result += "\n**5. Подключение к Pinecone:**\n"
+    # 5. Check local vector store
+    result += "\n**5. Локальное векторное хранилище:**\n"
     try:
-        from src.services.vector_db import pinecone_index
-        stats = pinecone_index.describe_index_stats()
+        from src.services.vector_db import vector_store
+        stats = vector_store.describe()
         
         total_vectors = stats.get('total_vector_count', 0)
         namespaces = stats.get('namespaces', {})
         
-        result += f"✅ Подключение успешно\n"
+        result += f"✅ Хранилище доступно ({vector_store.root})\n"
         result += f"• Общее количество векторов: {total_vectors}\n"
         result += f"• Количество namespace: {len(namespaces)}\n"
         
@@ -220,7 +216,69 @@ async def debug_system_command(message: Message):
                 result += f"  - {ns}: {ns_stats.get('vector_count', 0)} векторов\n"
                 
     except Exception as e:
-        result += f"❌ Ошибка подключения к Pinecone: {e}\n"
+        result += f"❌ Ошибка векторного хранилища: {e}\n"
+    
+    # 6. Routing cache
+    result += "\n**6. Кэш маршрутизации чатов:**\n"
+    routing_stats = get_routing_cache_stats()
+    result += f"• Записей: {routing_stats['size']}/{routing_stats['max_size']}\n"
+    result += f"• Попадания/промахи: {routing_stats['hits']}/{routing_stats['misses']} ({routing_stats['hit_rate']:.0%})\n"
+    
+    # 7. Team metadata cache
+    result += "\n**7. Кэш данных команд:**\n"
+    team_stats = get_team_cache_stats()
+    result += f"• Записей: {team_stats['size']}/{team_stats['max_size']}\n"
+    result += f"• Попадания/промахи: {team_stats['hits']}/{team_stats['misses']} ({team_stats['hit_rate']:.0%})\n"
+    
+    # 8. Answer cache
+    result += "\n**8. Кэш ответов ИИ:**\n"
+    answer_stats = answer_cache.stats()
+    result += f"• Записей: {answer_stats['size']}/{answer_stats['max_size']}\n"
+    result += f"• Попадания/промахи: {answer_stats['hits']}/{answer_stats['misses']} ({answer_stats['hit_rate']:.0%}), из них похожих вопросов: {answer_stats['semantic_hits']}\n"
+    result += f"• Сэкономлено времени генерации: {answer_stats['saved_seconds']:.1f} с\n"
+    
+    # 9. LLM request queue
+    result += "\n**9. Очередь запросов к ИИ:**\n"
+    queue_stats = llm_scheduler.stats()
+    result += f"• В работе: {queue_stats['in_flight']}/{queue_stats['max_in_flight']}\n"
+    for name, title in (("interactive", "Вопросы"), ("background", "Фоновые задачи")):
+        q = queue_stats[name]
+        result += (
+            f"• {title}: в очереди {q['queued']} (команд: {q['teams_waiting']}), "
+            f"ожидание avg {q['avg_wait']:.2f} с / p95 {q['p95_wait']:.2f} с, "
+            f"таймаутов {q['timeouts']}\n"
+        )
+    
+    # 10. vLLM circuit breaker
+    result += "\n**10. Доступность ИИ (circuit breaker):**\n"
+    breaker = vllm_breaker.stats()
+    state_titles = {
+        "closed": "✅ закрыт (запросы идут)",
+        "half_open": "🩺 пробный запрос",
+        "open": f"🔌 открыт, проверка через {breaker['retry_in']:.0f} с",
+        "disabled": "⚪ выключен",
+    }
+    result += f"• Состояние: {state_titles[breaker['state']]}\n"
+    result += (
+        f"• Ошибок: {breaker['error_rate']:.0%} из {breaker['window']} последних, "
+        f"подряд {breaker['failures_in_row']}"
+        + (f" (последняя: {breaker['last_failure']})" if breaker['last_failure'] else "")
+        + "\n"
+    )
+    result += f"• Открывался: {breaker['opened']} раз, отклонено запросов: {breaker['rejected']}, проверок: {breaker['probes']}\n"
+    kind_titles = {"completion": "ответа", "background": "фоновых задач", "first_token": "первого фрагмента"}
+    for kind, latency in breaker['latency'].items():
+        result += f"• Задержка {kind_titles.get(kind, kind)}: p50 {latency['p50']:.2f} с / p95 {latency['p95']:.2f} с, таймаут {latency['timeout']:.1f} с\n"
+    
+    # 11. Prompt prefix reuse
+    result += "\n**11. Общий префикс промптов (prefix caching vLLM):**\n"
+    prefix_stats = prefix_tracker.stats()
+    result += f"• Запросов: {prefix_stats['requests']}, API: {settings.vllm_api}\n"
+    result += (
+        f"• Совпадает с предыдущими: {prefix_stats['avg_shared_tokens']:.0f} из "
+        f"{prefix_stats['avg_prompt_tokens']:.0f} токенов в среднем ({prefix_stats['shared_ratio']:.0%}), "
+        f"в последнем запросе {prefix_stats['last_shared_tokens']}\n"
+    )
     
     result += "\n**💡 Рекомендации:**\n"
     result += "• Убедитесь, что чат привязан к команде (/link_chat)\n"
@@ -230,6 +288,62 @@ async def debug_system_command(message: Message):
     
     await message.answer(result, parse_mode="Markdown")
 
+def format_trace(trace: Trace, title: str, max_spans: int = 30) -> str:
+    """Timeline of one traced turn: start offset, duration and attributes of every span"""
+    attributes = trace.attributes
+    ago = int(time.time() - trace.started_at)
+    lines = []
+    for depth, offset, span in trace.timeline()[1:max_spans + 1]:
+        details = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+        if span.error:
+            details = f"{details} ❌ {span.error}".strip()
+        line = f"{offset * 1000:>7.0f} {span.duration * 1000:>7.0f}  {'  ' * (depth - 1)}{span.name}  {details[:80]}"
+        lines.append(line.rstrip())
+    hidden = len(trace.spans) - 1 - max_spans
+    if hidden > 0:
+        lines.append(f"... и еще {hidden} этапов")
+    return (
+        f"🐢 <b>{trace.duration:.2f} с</b> · {html.escape(title)} · {attributes.get('outcome', '?')} · "
+        f"вопрос {attributes.get('question_chars', 0)} симв. · {ago // 60} мин назад\n"
+        f"<pre>старт,мс длит,мс  этап\n{html.escape(chr(10).join(lines))}</pre>"
+    )
+
+@router.message(Command("slow_traces"))
+async def slow_traces_command(message: Message, command: CommandObject):
+    """Самые медленные из последних вопросов к ИИ с разбивкой по этапам (для админов)"""
+    user_id = message.from_user.id
+    try:
+        admin_teams = await get_user_admin_teams(user_id)
+        if not admin_teams:
+            await message.answer("❌ У вас нет прав администратора команд.")
+            return
+
+        if not settings.tracing_enabled:
+            await message.answer("⚪ Трассировка выключена (TRACING_ENABLED=false).")
+            return
+
+        try:
+            count = min(max(int(command.args or 5), 1), 10)
+        except ValueError:
+            count = 5
+
+        team_names = {team['id']: team['name'] for team in admin_teams}
+        traces = trace_store.slowest(count, team_ids=team_names)
+        if not traces:
+            await message.answer("📭 Среди последних вопросов к ИИ нет вопросов ваших команд.")
+            return
+
+        await message.answer(
+            f"🔎 <b>Самые медленные ответы ИИ</b> ({len(traces)} из последних {len(trace_store)} вопросов)",
+            parse_mode="HTML"
+        )
+        for trace in traces:
+            title = team_names.get(trace.attributes.get("team_id"), "?")
+            await message.answer(format_trace(trace, title), parse_mode="HTML")
+
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении трасс: {html.escape(str(e))}", parse_mode="HTML")
+
 # --- Create Team Handler ---
 @router.message(Command("create_team"))
 async def create_team_command(message: Message, state: FSMContext):
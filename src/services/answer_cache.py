@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+from src.services.cache import TTLCache
+from src.settings import settings
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return re.sub(r"\s+", " ", question).strip()
+
+
+def context_fingerprint(context: str) -> str:
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    LRU cache of generated answers in front of the LLM.
+
+    Exact hits are keyed on (team, normalized question, context fingerprint).
+    When an embedding of the question is available, a question whose cosine
+    similarity to a cached one of the same team and the same context is above
+    the threshold also hits. Entries of a team are dropped as soon as new
+    messages arrive for it.
+    """
+
+    def __init__(self, max_entries: int, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # Embeddings computed during lookup are reused by the following store
+        self._embeddings = TTLCache(max_size=256, ttl=300)
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def _embed(self, question: str) -> Optional[np.ndarray]:
+        if not settings.answer_cache_semantic:
+            return None
+        normalized = normalize_question(question)
+        cached = self._embeddings.get(normalized)
+        if cached is not None:
+            return cached
+        try:
+            from src.services.vector_db import get_embedding, embedding_model_manager
+            if not embedding_model_manager.is_ready:
+                # Never hold a Q&A turn for a model load, fall back to exact matching
+                return None
+            vector = np.asarray(await get_embedding(question), dtype=np.float32)
+        except Exception as e:
+            logging.debug(f"Answer cache: no embedding for semantic lookup: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        vector /= norm
+        self._embeddings.set(normalized, vector)
+        return vector
+
+    def _hit(self, key: tuple, entry: Dict[str, Any], semantic: bool) -> str:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if semantic:
+            self.semantic_hits += 1
+        self.saved_seconds += entry["generation_time"]
+        return entry["answer"]
+
+    async def lookup(self, team_id: str, question: str, context: str) -> Optional[str]:
+        """Return a cached answer for this question, or None on a miss"""
+        key = (team_id, normalize_question(question), context_fingerprint(context))
+        entry = self._entries.get(key)
+        if entry is not None:
+            return self._hit(key, entry, semantic=False)
+
+        vector = await self._embed(question)
+        if vector is not None:
+            best_key, best_score = None, self.similarity_threshold
+            for other_key, other in self._entries.items():
+                # The answer is only valid for the context (system message, summaries,
+                # retrieved messages) it was generated from
+                if other_key[0] != team_id or other_key[2] != key[2] or other["embedding"] is None:
+                    continue
+                score = float(np.dot(vector, other["embedding"]))
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is not None:
+                logging.info(f"💾 Semantic answer cache hit for team {team_id} (similarity {best_score:.3f})")
+                return self._hit(best_key, self._entries[best_key], semantic=True)
+
+        self.misses += 1
+        return None
+
+    async def store(self, team_id: str, question: str, context: str, answer: str, generation_time: float):
+        """Cache a generated answer; error replies are not cached"""
+        if self.max_entries <= 0 or not answer or answer.startswith("❌"):
+            return
+        key = (team_id, normalize_question(question), context_fingerprint(context))
+        self._entries[key] = {
+            "answer": answer,
+            "generation_time": generation_time,
+            "embedding": await self._embed(question),
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_team(self, team_id: str):
+        """Drop every cached answer of a team (called when new messages land)"""
+        stale: List[tuple] = [key for key in self._entries if key[0] == team_id]
+        for key in stale:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_entries,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.answer_cache_max_entries,
+    similarity_threshold=settings.answer_cache_similarity_threshold,
+)
@@ -0,0 +1,245 @@
+import logging
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from src.settings import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """vLLM is considered down, the call was rejected without being sent"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker and adaptive timeouts for one backend.
+
+    - closed: calls go through. Outcomes are kept in a rolling window, and the
+      breaker opens after consecutive_failures failures in a row, or when the
+      error rate of the window reaches error_rate (once it holds min_requests).
+    - open: calls are rejected at once with CircuitOpen. After the cooldown the
+      next caller runs the health probe (shared by everyone arriving meanwhile).
+      A healthy probe moves to half_open; an unhealthy one keeps the breaker
+      open with a doubled cooldown, up to max_open_seconds.
+    - half_open: one trial call goes through. Success closes the breaker,
+      failure opens it again.
+
+    Timeouts follow the observed latency: p95 of the recent successful calls of
+    a kind times timeout_multiplier, clamped to [min_timeout, max_timeout].
+    Until min_latency_samples are collected, max_timeout is used.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe: Callable[[], Awaitable[bool]],
+        window: int = 20,
+        min_requests: int = 5,
+        error_rate: float = 0.5,
+        consecutive_failures: int = 3,
+        open_seconds: float = 10.0,
+        max_open_seconds: float = 120.0,
+        max_timeout: float = 30.0,
+        min_timeout: float = 5.0,
+        timeout_multiplier: float = 2.0,
+        min_latency_samples: int = 20,
+        enabled: bool = True,
+        adaptive_timeout: bool = True,
+    ):
+        self.name = name
+        self.probe = probe
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate
+        self.consecutive_failures = consecutive_failures
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.timeout_multiplier = timeout_multiplier
+        self.min_latency_samples = min_latency_samples
+        self.enabled = enabled
+        self.adaptive_timeout = adaptive_timeout
+
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=max(1, window))
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._failures_in_row = 0
+        self._cooldown = open_seconds
+        self._open_until = 0.0
+        self._trial_started: Optional[float] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self.last_failure: Optional[str] = None
+
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+
+    # --- admission -----------------------------------------------------------
+
+    def _reject(self):
+        self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit is {self.state}, retry in {self.retry_in:.0f}s")
+
+    async def allow(self):
+        """Raises CircuitOpen unless a call may be sent to the backend now"""
+        if not self.enabled or self.state == CLOSED:
+            return
+        if self.state == OPEN:
+            if time.monotonic() < self._open_until:
+                self._reject()
+            await self._run_probe()
+            if self.state != HALF_OPEN:
+                self._reject()
+        # A trial whose caller went away without reporting expires after max_timeout
+        now = time.monotonic()
+        if self._trial_started is not None and now - self._trial_started < self.max_timeout:
+            self._reject()
+        self._trial_started = now
+
+    async def _run_probe(self):
+        if self._probe_task is None:
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_once())
+        task = self._probe_task
+        try:
+            await asyncio.shield(task)
+        finally:
+            if task.done() and self._probe_task is task:
+                self._probe_task = None
+
+    async def _probe_once(self):
+        self.probes += 1
+        try:
+            healthy = await self.probe()
+        except Exception as e:
+            logging.warning(f"⚠️ {self.name} health probe failed: {e}")
+            healthy = False
+        if self.state != OPEN:
+            return
+        if healthy:
+            logging.info(f"🩺 {self.name} health probe passed, letting a trial request through")
+            self.state = HALF_OPEN
+            self._trial_started = None
+        else:
+            self._open("health probe failed", backoff=True)
+
+    # --- outcomes ------------------------------------------------------------
+
+    def record_success(self):
+        self._outcomes.append(True)
+        self._failures_in_row = 0
+        if self.state != CLOSED:
+            self._close()
+
+    def record_failure(self, reason: str):
+        self._outcomes.append(False)
+        self._failures_in_row += 1
+        self.last_failure = reason
+        if not self.enabled:
+            return
+        if self.state == HALF_OPEN:
+            self._open(reason, backoff=True)
+        elif self.state == CLOSED and (
+            self._failures_in_row >= self.consecutive_failures
+            or (len(self._outcomes) >= self.min_requests and self.error_rate >= self.error_rate_threshold)
+        ):
+            self._open(reason)
+
+    def observe(self, kind: str, seconds: float):
+        """Latency of a successful call of the given kind, used for timeout()"""
+        self._latencies.setdefault(kind, deque(maxlen=200)).append(seconds)
+
+    def _open(self, reason: str, backoff: bool = False):
+        if backoff:
+            self._cooldown = min(self._cooldown * 2, self.max_open_seconds)
+        self.state = OPEN
+        self.opened += 1
+        self._open_until = time.monotonic() + self._cooldown
+        self._trial_started = None
+        logging.error(
+            f"🔌 {self.name} circuit opened ({reason}, error rate {self.error_rate:.0%}), "
+            f"rejecting requests for {self._cooldown:.0f}s"
+        )
+
+    def _close(self):
+        logging.info(f"✅ {self.name} circuit closed, backend is back")
+        self.state = CLOSED
+        self._cooldown = self.open_seconds
+        self._trial_started = None
+        self._outcomes.clear()
+
+    # --- reporting -----------------------------------------------------------
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    @property
+    def retry_in(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    def _percentile(self, kind: str, q: float) -> Optional[float]:
+        samples = sorted(self._latencies.get(kind, ()))
+        if not samples:
+            return None
+        return samples[max(0, int(len(samples) * q) - 1)]
+
+    def timeout(self, kind: str) -> float:
+        """Timeout for the next call of the given kind"""
+        samples = self._latencies.get(kind)
+        if not self.adaptive_timeout or samples is None or len(samples) < self.min_latency_samples:
+            return self.max_timeout
+        adaptive = self._percentile(kind, 0.95) * self.timeout_multiplier
+        return min(self.max_timeout, max(self.min_timeout, adaptive))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state if self.enabled else "disabled",
+            "error_rate": self.error_rate,
+            "window": len(self._outcomes),
+            "failures_in_row": self._failures_in_row,
+            "last_failure": self.last_failure,
+            "retry_in": self.retry_in,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "probes": self.probes,
+            "latency": {
+                kind: {
+                    "samples": len(samples),
+                    "p50": self._percentile(kind, 0.5),
+                    "p95": self._percentile(kind, 0.95),
+                    "timeout": self.timeout(kind),
+                }
+                for kind, samples in self._latencies.items()
+            },
+        }
+
+
+async def _probe_vllm() -> bool:
+    from src.services.llm import check_vllm_health
+    return (await check_vllm_health())["status"] == "healthy"
+
+
+vllm_breaker = CircuitBreaker(
+    "vLLM",
+    probe=_probe_vllm,
+    window=settings.llm_breaker_window,
+    min_requests=settings.llm_breaker_min_requests,
+    error_rate=settings.llm_breaker_error_rate,
+    consecutive_failures=settings.llm_breaker_consecutive_failures,
+    open_seconds=settings.llm_breaker_open_seconds,
+    max_open_seconds=settings.llm_breaker_max_open_seconds,
+    max_timeout=settings.vllm_timeout,
+    min_timeout=settings.llm_timeout_min,
+    timeout_multiplier=settings.llm_timeout_p95_multiplier,
+    enabled=settings.llm_breaker_enabled,
+    adaptive_timeout=settings.llm_adaptive_timeout,
+)
@@ -0,0 +1,237 @@
+import logging
+import asyncio
+import re
+from typing import Optional, List, Dict, Any, Tuple
+
+from src.settings import settings
+
+# Rough chars-per-token ratio for mixed Russian/English chat text, used only when
+# the model tokenizer cannot be loaded. Errs on the side of overcounting.
+_FALLBACK_CHARS_PER_TOKEN = 3
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock: Optional[asyncio.Lock] = None
+
+
+def _load_tokenizer():
+    """Load the served model's tokenizer (blocking, runs once)"""
+    name = settings.vllm_tokenizer or settings.vllm_model_name
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        logging.info(f"✅ Tokenizer '{name}' loaded for context packing")
+        return tokenizer
+    except ImportError:
+        logging.warning("⚠️ 'transformers' is not installed, using approximate token counts")
+    except Exception as e:
+        logging.error(f"❌ Failed to load tokenizer '{name}', using approximate token counts: {e}")
+    return None
+
+
+async def ensure_tokenizer():
+    """Load the tokenizer in a worker thread on first use; later calls return immediately"""
+    global _tokenizer, _tokenizer_loaded, _tokenizer_lock
+    if _tokenizer_loaded:
+        return
+    if _tokenizer_lock is None:
+        _tokenizer_lock = asyncio.Lock()
+    async with _tokenizer_lock:
+        if _tokenizer_loaded:
+            return
+        loop = asyncio.get_running_loop()
+        _tokenizer = await loop.run_in_executor(None, _load_tokenizer)
+        _tokenizer_loaded = True
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the model tokenizer, or estimate them if it is unavailable"""
+    if not text:
+        return 0
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text, add_special_tokens=False))
+    return -(-len(text) // _FALLBACK_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to max_tokens, ending on a word boundary with an ellipsis"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    if _tokenizer is not None:
+        ids = _tokenizer.encode(text, add_special_tokens=False)[:max_tokens - 1]
+        truncated = _tokenizer.decode(ids)
+    else:
+        truncated = text[:(max_tokens - 1) * _FALLBACK_CHARS_PER_TOKEN]
+
+    # Drop a trailing partial word rather than showing half of it
+    cut = truncated.rfind(" ")
+    if cut > len(truncated) // 2:
+        truncated = truncated[:cut]
+    return truncated.rstrip() + "…"
+
+
+def _dedup_key(msg: Dict[str, Any]) -> str:
+    return re.sub(r"\s+", " ", (msg.get("text") or "").strip().lower())
+
+
+def _message_key(msg: Dict[str, Any]) -> Any:
+    return (msg.get("chat_id"), msg.get("message_id")) if msg.get("message_id") is not None else msg.get("id")
+
+
+def _format_line(msg: Dict[str, Any], message_max_tokens: int) -> Tuple[str, bool]:
+    """Context line for a message and whether its text had to be truncated"""
+    text = (msg.get("text") or "").strip()
+    short_text = truncate_to_tokens(text, message_max_tokens)
+    return f"{msg.get('user_name', 'Unknown')}: {short_text}", short_text != text
+
+
+def pack_context(
+    messages: List[Dict[str, Any]],
+    header: str = "",
+    footer: str = "",
+    max_tokens: Optional[int] = None,
+    message_max_tokens: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Build the context block from search results within a token budget.
+
+    Messages are taken in the given (relevance) order. Duplicates by message id
+    or by normalized text are skipped, each message is truncated to
+    message_max_tokens, and packing stops once the next line no longer fits.
+
+    Returns a dict with the context text, the number of tokens it uses and
+    counters of used, truncated, duplicate and dropped messages.
+    """
+    max_tokens = settings.context_max_tokens if max_tokens is None else max_tokens
+    message_max_tokens = settings.context_message_max_tokens if message_max_tokens is None else message_max_tokens
+
+    token_count = count_tokens(header) + count_tokens(footer)
+    lines = []
+    used = []
+    seen_ids = set()
+    seen_texts = set()
+    truncated = duplicates = dropped = 0
+
+    for msg in messages:
+        text = (msg.get("text") or "").strip()
+        if not text:
+            continue
+
+        msg_key = _message_key(msg)
+        text_key = _dedup_key(msg)
+        if (msg_key is not None and msg_key in seen_ids) or text_key in seen_texts:
+            duplicates += 1
+            continue
+
+        line, was_truncated = _format_line(msg, message_max_tokens)
+
+        # +1 for the newline that joins the lines
+        line_tokens = count_tokens(line) + 1
+        if token_count + line_tokens > max_tokens:
+            dropped += 1
+            continue
+
+        token_count += line_tokens
+        truncated += was_truncated
+        lines.append(line)
+        used.append(msg)
+        if msg_key is not None:
+            seen_ids.add(msg_key)
+        seen_texts.add(text_key)
+
+    return {
+        "context": header + "\n".join(lines) + footer if lines else "",
+        "messages": used,
+        "token_count": token_count if lines else 0,
+        "truncated": truncated,
+        "duplicates": duplicates,
+        "dropped": dropped,
+        "exact": _tokenizer is not None,
+    }
+
+
+def pack_snippets(
+    snippets: List[Dict[str, Any]],
+    header: str = "",
+    footer: str = "",
+    max_tokens: Optional[int] = None,
+    message_max_tokens: Optional[int] = None,
+    separator: str = "\n…\n",
+) -> Dict[str, Any]:
+    """
+    Build the context block from conversation snippets within a token budget.
+
+    Snippets ({"messages", "hits"} from expand_with_neighbors) are taken in
+    relevance order. The retrieved messages of all snippets go in first, then
+    their neighbours closest first while they fit; the chosen lines of each
+    snippet are written in conversation order, snippets joined by the separator.
+    Duplicates are skipped the same way as in pack_context.
+
+    Returns the same dict as pack_context plus the number of snippets used.
+    """
+    max_tokens = settings.context_max_tokens if max_tokens is None else max_tokens
+    message_max_tokens = settings.context_message_max_tokens if message_max_tokens is None else message_max_tokens
+
+    token_count = count_tokens(header) + count_tokens(footer)
+    separator_tokens = count_tokens(separator)
+    blocks = []
+    used = []
+    seen_ids = set()
+    seen_texts = set()
+    truncated = duplicates = dropped = 0
+
+    prepared = []
+    for snippet in snippets:
+        messages = [msg for msg in snippet["messages"] if (msg.get("text") or "").strip()]
+        hit_positions = [i for i, msg in enumerate(messages) if _message_key(msg) in snippet.get("hits", ())]
+        if not hit_positions:
+            hit_positions = list(range(len(messages)))
+        distance = {i: min(abs(i - h) for h in hit_positions) for i in range(len(messages))}
+        prepared.append((messages, distance, {}))
+
+    # Retrieved messages of every snippet go in before any neighbour, then
+    # neighbours are added closest first
+    candidates = sorted(
+        (dist, n, i) for n, (_, distance, _) in enumerate(prepared) for i, dist in distance.items()
+    )
+    for _, n, i in candidates:
+        messages, _, chosen = prepared[n]
+        msg = messages[i]
+        msg_key = _message_key(msg)
+        text_key = _dedup_key(msg)
+        if (msg_key is not None and msg_key in seen_ids) or text_key in seen_texts:
+            duplicates += 1
+            continue
+
+        line, was_truncated = _format_line(msg, message_max_tokens)
+        # +1 for the newline; the first line of a snippet also pays for a separator
+        line_tokens = count_tokens(line) + 1 + (separator_tokens if not chosen else 0)
+        if token_count + line_tokens > max_tokens:
+            dropped += 1
+            continue
+
+        token_count += line_tokens
+        truncated += was_truncated
+        chosen[i] = line
+        if msg_key is not None:
+            seen_ids.add(msg_key)
+        seen_texts.add(text_key)
+
+    for messages, _, chosen in prepared:
+        if chosen:
+            blocks.append("\n".join(chosen[i] for i in sorted(chosen)))
+            used.extend(messages[i] for i in sorted(chosen))
+
+    return {
+        "context": header + separator.join(blocks) + footer if blocks else "",
+        "messages": used,
+        "snippets": len(blocks),
+        "token_count": token_count if blocks else 0,
+        "truncated": truncated,
+        "duplicates": duplicates,
+        "dropped": dropped,
+        "exact": _tokenizer is not None,
+    }
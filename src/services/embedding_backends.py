@@ -0,0 +1,71 @@
+import logging
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+# Default quantized ONNX export shipped in the model's Hugging Face repository.
+# It runs on any AVX2 CPU; the repository also has onnx/model_qint8_avx512.onnx,
+# onnx/model_qint8_avx512_vnni.onnx and onnx/model_qint8_arm64.onnx (EMBEDDING_ONNX_FILE)
+DEFAULT_ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+def _load_torch(model_name: str, **options) -> Any:
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def _load_torch_int8(model_name: str, **options) -> Any:
+    """Same model with its Linear layers dynamically quantized to int8"""
+    import torch
+    model = _load_torch(model_name)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_onnx(model_name: str, **options) -> Any:
+    """ONNX Runtime export of the model (needs sentence-transformers[onnx])"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu", backend="onnx")
+
+
+def _load_onnx_int8(model_name: str, onnx_file: str = None, **options) -> Any:
+    """Quantized ONNX export of the model (needs sentence-transformers[onnx])"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(
+        model_name,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": onnx_file or DEFAULT_ONNX_INT8_FILE},
+    )
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[..., Any]] = {
+    "torch": _load_torch,
+    "torch-int8": _load_torch_int8,
+    "onnx": _load_onnx,
+    "onnx-int8": _load_onnx_int8,
+}
+
+
+def load_embedding_backend(backend: str, model_name: str, **options) -> Any:
+    """
+    Load the embedding model with the given backend.
+
+    Every backend returns an object with the SentenceTransformer
+    ``encode(texts, batch_size=...)`` interface, so callers do not care which
+    one is in use.
+    """
+    loader = EMBEDDING_BACKENDS.get(backend)
+    if loader is None:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of: {', '.join(EMBEDDING_BACKENDS)}")
+    logging.info(f"🧠 Embedding backend: {backend}")
+    return loader(model_name, **options)
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Row-wise cosine similarity between two embedding matrices of the same texts"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines: List[float] = np.sum(reference * candidate, axis=1).tolist()
+    return {"mean": float(np.mean(cosines)), "min": float(np.min(cosines))}
@@ -0,0 +1,109 @@
+import logging
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class EmbeddingModelNotReady(Exception):
+    """The embedding model failed to load or did not become ready in time"""
+
+
+def current_rss_mb() -> float:
+    """Resident memory of this process in MB (0 if it cannot be read)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except Exception:
+        return 0.0
+
+
+class EmbeddingModelManager:
+    """
+    Loads the embedding model lazily: on first use, or in the background via
+    start_warmup(). Callers await wait_ready() instead of finding a None model.
+
+    States: not_loaded -> loading -> ready | failed
+    """
+
+    def __init__(self, loader: Callable[[], Any], name: str):
+        self.loader = loader
+        self.name = name
+        self.model: Any = None
+        self.state = "not_loaded"
+        self.error: Optional[str] = None
+        self.load_time: Optional[float] = None
+        self.rss_delta_mb: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def _load_blocking(self):
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        model = self.loader()
+        self.load_time = time.perf_counter() - start
+        self.rss_delta_mb = current_rss_mb() - rss_before
+        return model
+
+    async def _load(self):
+        self.state = "loading"
+        logging.info(f"🧠 Loading embedding model {self.name}...")
+        loop = asyncio.get_running_loop()
+        try:
+            self.model = await loop.run_in_executor(None, self._load_blocking)
+        except Exception as e:
+            self.state = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            logging.error(f"❌ Failed to load embedding model {self.name}: {e}")
+            return
+        self.state = "ready"
+        logging.info(
+            f"✅ Embedding model {self.name} loaded in {self.load_time:.1f}s "
+            f"(+{self.rss_delta_mb:.0f} MB RSS)"
+        )
+
+    def start_warmup(self) -> asyncio.Task:
+        """Start loading in the background if it has not started yet"""
+        if self._task is None or (self.state == "failed" and self._task.done()):
+            self.error = None
+            self.state = "loading"
+            self._task = asyncio.get_running_loop().create_task(self._load(), name="embedding-model-warmup")
+        return self._task
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> Any:
+        """Wait until the model is loaded and return it"""
+        if self.state == "ready":
+            return self.model
+        if self.state == "failed":
+            # A failed load is only retried by an explicit start_warmup()
+            raise EmbeddingModelNotReady(f"Embedding model {self.name} failed to load: {self.error}")
+        task = self.start_warmup()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise EmbeddingModelNotReady(f"Embedding model {self.name} is still loading")
+        if self.state != "ready":
+            raise EmbeddingModelNotReady(f"Embedding model {self.name} failed to load: {self.error}")
+        return self.model
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "load_time": self.load_time,
+            "rss_delta_mb": self.rss_delta_mb,
+            "rss_mb": current_rss_mb(),
+            "error": self.error,
+        }
@@ -0,0 +1,223 @@
+import logging
+import re
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Deque, NamedTuple, Set
+
+from src.settings import settings
+
+# Questions purely about what is going on right now; they are answered from the hot window.
+# A time word alone is not enough: "какое последнее решение по оплате?" is a topical
+# question and needs hybrid_search over the whole history.
+_RECENT_TIME = (
+    r"(?:сейчас|сегодня|только что|недавно|на днях|"
+    r"за (?:последн\w* )?(?:час|день|сутки|\d+ (?:час\w*|минут\w*))|"
+    r"now|today|recently|lately|just now|in the last (?:hour|day|\d+ (?:hours?|minutes?)))"
+)
+_DISCUSSION = r"(?:обсужда\w*|говори\w*|пиш\w*|писали|происходит|происходило|нового|discuss\w*|talk\w*|going on|happen\w*)"
+_RECENCY_PATTERN = re.compile(
+    rf"^\W*(?:"
+    rf"что нового|что новенького|какие новости|"
+    rf"what'?s new|any news|"
+    rf"(?:что|о ч[её]м|про что|what|what'?s|what are (?:we|people|you guys)) (?:\w+ ){{0,2}}?"
+    rf"(?:{_RECENT_TIME} {_DISCUSSION}|{_DISCUSSION}(?: \w+){{0,2}}? {_RECENT_TIME})|"
+    rf"(?:покажи |перескажи |show |summari[sz]e )?(?:последние|свежие|latest|recent|last) (?:сообщения|messages)"
+    rf")(?: (?:в|у нас в|in|in the) (?:чате|группе|команде|chat|group|team))?\W*$",
+    re.IGNORECASE,
+)
+
+
+def is_recency_question(question: str) -> bool:
+    """
+    True for questions like 'что сейчас обсуждаем?' or 'последние сообщения' that
+    only need the latest messages; questions about a topic go through the search
+    """
+    return bool(_RECENCY_PATTERN.match(question.strip()))
+
+
+class HotMessage(NamedTuple):
+    """Compact in-memory record of a chat message"""
+    ts: float
+    chat_id: int
+    message_id: int
+    user_name: str
+    text: str
+
+    def size(self) -> int:
+        # Tuple and int/float overhead is constant, the strings dominate
+        return sys.getsizeof(self.text) + sys.getsizeof(self.user_name) + 120
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "chat_id": self.chat_id,
+            "message_id": self.message_id,
+            "user_name": self.user_name,
+            "text": self.text,
+            "created_at": datetime.fromtimestamp(self.ts, tz=timezone.utc).isoformat(),
+        }
+
+
+def _parse_timestamp(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class HotWindow:
+    """
+    Ring buffer of the latest messages of every team.
+
+    A team keeps at most max_messages messages younger than max_hours. The
+    total size of all buffers is capped at max_bytes; above it the globally
+    oldest messages are dropped first. A team is "warm" once its buffer was
+    filled from the database, only then does it cover the whole window; it
+    stops being warm when the byte cap evicts one of its messages.
+    """
+
+    def __init__(self, max_messages: int, max_hours: float, max_bytes: int):
+        self.max_messages = max_messages
+        self.max_age = max_hours * 3600
+        self.max_bytes = max_bytes
+        self._buffers: Dict[str, Deque[HotMessage]] = {}
+        self._warm: Set[str] = set()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def _pop_oldest(self, team_id: str):
+        buffer = self._buffers[team_id]
+        self.total_bytes -= buffer.popleft().size()
+        if not buffer:
+            del self._buffers[team_id]
+
+    def _append(self, team_id: str, record: HotMessage):
+        buffer = self._buffers.setdefault(team_id, deque())
+        if len(buffer) >= self.max_messages:
+            self._pop_oldest(team_id)
+            buffer = self._buffers.setdefault(team_id, buffer)
+        buffer.append(record)
+        self.total_bytes += record.size()
+        while self.total_bytes > self.max_bytes and self._buffers:
+            oldest_team = min(self._buffers, key=lambda team: self._buffers[team][0].ts)
+            self._pop_oldest(oldest_team)
+            # The buffer no longer holds the whole window of that team
+            self._warm.discard(oldest_team)
+            self.evictions += 1
+
+    def _expire(self, team_id: str, now: float):
+        buffer = self._buffers.get(team_id)
+        while buffer and now - buffer[0].ts > self.max_age:
+            self._pop_oldest(team_id)
+            buffer = self._buffers.get(team_id)
+
+    def add(self, team_id: str, chat_id: int, message_id: int, user_name: str, text: str, ts: Optional[float] = None):
+        """Record a new message of a linked chat"""
+        ts = ts or time.time()
+        if self.max_messages <= 0 or time.time() - ts > self.max_age:
+            return
+        self._append(team_id, HotMessage(ts, chat_id, message_id, user_name or "Unknown", text))
+
+    def load(self, team_id: str, rows: List[Dict[str, Any]]):
+        """Fill a team buffer from database rows (oldest first) and mark it warm"""
+        known = {(record.chat_id, record.message_id) for record in self._buffers.get(team_id, ())}
+        records = [
+            HotMessage(
+                _parse_timestamp(row.get("created_at")),
+                row.get("chat_id"),
+                row.get("message_id"),
+                row.get("user_name") or "Unknown",
+                row.get("text") or "",
+            )
+            for row in rows[-self.max_messages:]
+            if (row.get("chat_id"), row.get("message_id")) not in known
+        ]
+        # Messages that arrived while loading are newer than the rows, keep them last
+        merged = sorted(records + list(self._buffers.get(team_id, ())), key=lambda record: record.ts)
+        self.clear(team_id)
+        # Marked first, so an eviction while filling leaves the team cold
+        self._warm.add(team_id)
+        for record in merged:
+            self._append(team_id, record)
+
+    def is_warm(self, team_id: str) -> bool:
+        return team_id in self._warm
+
+    def lookup(self, team_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Messages to answer a recency question with, or None (a miss) when the
+        team buffer is cold or empty and the question has to go through search
+        """
+        messages = self.recent(team_id) if self.is_warm(team_id) else []
+        if not messages:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return messages
+
+    def recent(self, team_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Messages of the window, oldest first, as the dicts search functions return"""
+        self._expire(team_id, time.time())
+        records = list(self._buffers.get(team_id, ()))
+        if limit is not None:
+            records = records[-limit:]
+        return [record.as_dict() for record in records]
+
+    def clear(self, team_id: str):
+        for record in self._buffers.pop(team_id, ()):
+            self.total_bytes -= record.size()
+
+    def teams(self) -> List[str]:
+        return list(self._buffers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "teams": len(self._buffers),
+            "warm_teams": len(self._warm),
+            "messages": len(self),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+hot_window = HotWindow(
+    max_messages=settings.hot_window_max_messages,
+    max_hours=settings.hot_window_hours,
+    max_bytes=settings.hot_window_max_mb * 1024 * 1024,
+)
+
+
+async def warm_hot_window():
+    """Fill the hot window of every team from the database (run once at startup)"""
+    from src.services.supabase_client import get_all_team_ids, get_messages_between
+
+    now = datetime.now(timezone.utc)
+    start = (now - timedelta(hours=settings.hot_window_hours)).isoformat()
+    end = (now + timedelta(minutes=1)).isoformat()
+    loaded = 0
+    for team_id in await get_all_team_ids():
+        try:
+            rows = await get_messages_between(team_id, start, end)
+        except Exception as e:
+            logging.error(f"❌ Failed to load hot window of team {team_id}: {e}")
+            continue
+        hot_window.load(team_id, rows)
+        loaded += len(rows)
+    logging.info(
+        f"🔥 Hot window filled: {loaded} messages, {hot_window.stats()['messages']} kept "
+        f"({hot_window.total_bytes / 1024:.0f} KB)"
+    )
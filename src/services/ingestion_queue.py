@@ -0,0 +1,232 @@
+import logging
+import asyncio
+from typing import Optional, List, Dict, Set
+
+from src.services.supabase_client import save_message, save_messages
+from src.services.vector_db import index_messages, embedding_model_manager
+from src.services.embedding_model import EmbeddingModelNotReady
+from src.services.metrics import ingested_messages_total, retries_total
+from src.settings import settings
+
+# Saved rows kept for vector indexing while the embedding model is unavailable
+MAX_UNINDEXED_ROWS = 10000
+
+
+class MessageIngestionQueue:
+    """Write-behind buffer that turns single chat messages into bulk inserts"""
+
+    def __init__(self, batch_size: int, flush_interval_ms: int, max_size: int, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_size = max_size
+        self.max_retries = max_retries
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+        self._index_tasks: Set[asyncio.Task] = set()
+        # Producers waiting on a full queue; stop() lets them finish first
+        self._pending_puts = 0
+        self._puts_idle: Optional[asyncio.Event] = None
+        # Saved but not yet vector-indexed rows, indexed with the next batch
+        self._unindexed: List[Dict] = []
+
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self.dropped_rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        """Start the background flush worker"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        self._puts_idle = asyncio.Event()
+        self._worker = asyncio.create_task(self._run(), name="message-ingestion")
+        logging.info(
+            f"✅ Message ingestion queue started (batch={self.batch_size}, "
+            f"interval={int(self.flush_interval * 1000)}ms, max_size={self.max_size})"
+        )
+
+    async def put(self, row: Dict):
+        """Queue a message row; waits when the queue is full (backpressure)"""
+        if not self.running or self._closing:
+            # Queue is not accepting writes, fall back to a direct insert
+            await save_message(**row)
+            return
+        self._pending_puts += 1
+        try:
+            await self._queue.put(row)
+        finally:
+            self._pending_puts -= 1
+            if self._closing and self._pending_puts == 0:
+                self._puts_idle.set()
+
+    async def stop(self):
+        """Flush everything still queued and stop the worker"""
+        if not self.running:
+            return
+        self._closing = True
+        # A producer blocked on a full queue must get its row in before the
+        # sentinel, the worker keeps consuming meanwhile
+        if self._pending_puts:
+            await self._puts_idle.wait()
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+        if not self._queue.empty():
+            await self._drain()
+        if self._index_tasks:
+            await asyncio.gather(*self._index_tasks, return_exceptions=True)
+        logging.info(
+            f"✅ Message ingestion queue stopped "
+            f"(batches={self.flushed_batches}, rows={self.flushed_rows}, dropped={self.dropped_rows})"
+        )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self._queue.get()
+            if row is None:
+                await self._drain()
+                return
+
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            stop_requested = False
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stop_requested = True
+                    break
+                batch.append(row)
+
+            await self._flush(batch)
+
+            if stop_requested:
+                await self._drain()
+                return
+
+    async def _drain(self):
+        """Flush whatever is left in the queue after a stop request"""
+        batch = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is None:
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict]):
+        # Telegram can redeliver an update, keep one row per (chat_id, message_id)
+        rows = list({(row["chat_id"], row["message_id"]): row for row in batch}.values())
+
+        retry_delay = 0.5
+        for attempt in range(self.max_retries):
+            # The insert is an upsert on (chat_id, message_id), so a retry after a
+            # partially applied batch does not create duplicates (when the database
+            # has the unique constraint, see save_messages)
+            if await save_messages(rows):
+                self.flushed_batches += 1
+                self.flushed_rows += len(rows)
+                for row in rows:
+                    ingested_messages_total.inc(team_id=row["team_id"])
+                self._schedule_indexing(rows)
+                return
+            if attempt < self.max_retries - 1:
+                logging.warning(f"🔄 Retrying batch of {len(rows)} messages in {retry_delay}s")
+                retries_total.inc(operation="ingestion_flush")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+
+        self.dropped_rows += len(rows)
+        logging.error(f"❌ Dropped batch of {len(rows)} messages after {self.max_retries} attempts")
+
+
+    def _schedule_indexing(self, rows: List[Dict]):
+        """Embed a saved batch for vector search without holding up the next flush"""
+        if not settings.vector_index_messages:
+            return
+        task = asyncio.create_task(self._index(rows), name="message-indexing")
+        self._index_tasks.add(task)
+        task.add_done_callback(self._index_tasks.discard)
+
+    @property
+    def unindexed_rows(self) -> int:
+        return len(self._unindexed)
+
+    def _keep_unindexed(self, rows: List[Dict]):
+        self._unindexed.extend(rows)
+        overflow = len(self._unindexed) - MAX_UNINDEXED_ROWS
+        if overflow > 0:
+            # Full-text search still finds them, only vector search misses them
+            del self._unindexed[:overflow]
+            logging.warning(f"⚠️ {overflow} messages will not be indexed for vector search, backlog is full")
+
+    async def _index(self, rows: List[Dict]):
+        """
+        Index a saved batch, together with the batches that could not be
+        indexed before. Waits while the embedding model is still loading; if
+        it failed, the rows stay in the backlog until a later batch finds it ready.
+        """
+        try:
+            await embedding_model_manager.wait_ready()
+        except EmbeddingModelNotReady as e:
+            self._keep_unindexed(rows)
+            logging.warning(f"⚠️ {len(self._unindexed)} messages wait for vector indexing: {e}")
+            return
+        rows, self._unindexed = self._unindexed + rows, []
+        try:
+            await index_messages(rows)
+        except Exception as e:
+            # The rows are in the database already, full-text search still finds them
+            self._keep_unindexed(rows)
+            logging.warning(f"⚠️ Failed to index {len(rows)} messages for vector search, will retry: {e}")
+
+
+ingestion_queue = MessageIngestionQueue(
+    batch_size=settings.ingestion_batch_size,
+    flush_interval_ms=settings.ingestion_flush_interval_ms,
+    max_size=settings.ingestion_queue_max_size,
+    max_retries=settings.ingestion_max_retries,
+)
+
+
+async def enqueue_message(team_id: str, chat_id: int, message_id: int, user_id: int, user_name: str, text: str) -> None:
+    """Queue a message for a batched save, same arguments as save_message"""
+    await ingestion_queue.put({
+        "team_id": team_id,
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "user_id": user_id,
+        "user_name": user_name,
+        "text": text,
+    })
+
+
+def start_ingestion_queue():
+    """Start the message ingestion worker"""
+    ingestion_queue.start()
+
+
+async def stop_ingestion_queue():
+    """Flush pending messages and stop the worker"""
+    await ingestion_queue.stop()
@@ -1,133 +1,378 @@
 import httpx
+import json
 import logging
 import asyncio
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, Tuple, AsyncIterator, List, Union
+from src.services.single_flight import single_flight, single_flight_stream
+from src.services.llm_scheduler import llm_scheduler, LLMBusy, INTERACTIVE, BACKGROUND
+from src.services.circuit_breaker import vllm_breaker, CircuitOpen
+from src.services.prompt_template import PromptParts, render_prompt, render_messages, prefix_tracker
+from src.services.tracing import set_attributes
+from src.services.metrics import (
+    prompt_tokens, prompt_shared_tokens, llm_request_seconds, llm_first_token_seconds, retries_total
+)
 from src.settings import settings
 
-async def get_answer(context: str, question: str) -> str:
+# Ответ, когда очередь к vLLM не продвинулась за LLM_QUEUE_TIMEOUT
+BUSY_REPLY = "❌ Сервер ИИ сейчас занят другими запросами. Попробуйте через минуту."
+
+# Ответ, когда vLLM недоступен (в том числе сразу, пока circuit breaker открыт)
+UNAVAILABLE_REPLY = "❌ Сервер ИИ временно недоступен. Попробуйте позже."
+
+
+class StreamInterrupted(Exception):
+    """Поток vLLM оборвался после того, как часть ответа уже отдана"""
+
+
+class LLMClient:
+    """
+    Долгоживущий HTTP-клиент для vLLM с пулом соединений и keep-alive.
+    Создается один раз при старте бота, чтобы не открывать TCP/TLS соединение на каждый вопрос.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float,
+        connect_timeout: float,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http2: bool = False,
+    ):
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logging.warning("⚠️ HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+                http2 = False
+
+        self.base_url = base_url
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=http2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+
+    @classmethod
+    def from_settings(cls) -> "LLMClient":
+        return cls(
+            base_url=settings.vllm_url,
+            timeout=settings.vllm_timeout,
+            connect_timeout=settings.vllm_connect_timeout,
+            max_connections=settings.vllm_max_connections,
+            max_keepalive_connections=settings.vllm_max_keepalive_connections,
+            keepalive_expiry=settings.vllm_keepalive_expiry,
+            http2=settings.vllm_http2,
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    def _timeout(self, timeout: Optional[float]):
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+
+    @staticmethod
+    def _path(payload: Dict[str, Any]) -> str:
+        return "/v1/chat/completions" if "messages" in payload else "/v1/completions"
+
+    async def post_completion(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+        """POST /v1/completions (или /v1/chat/completions для payload с messages) через общий пул"""
+        return await self._client.post(self._path(payload), json=payload, timeout=self._timeout(timeout))
+
+    def stream_completion(self, payload: Dict[str, Any], timeout: Optional[float] = None):
+        """
+        То же со stream=True, возвращает async context manager с ответом
+        
+        timeout ограничивает ожидание каждого фрагмента, в том числе первого.
+        """
+        return self._client.stream("POST", self._path(payload), json=payload, timeout=self._timeout(timeout))
+
+    async def get_health(self, timeout: Optional[float] = None) -> httpx.Response:
+        """GET /health через общий пул соединений"""
+        if timeout is None:
+            return await self._client.get("/health")
+        return await self._client.get("/health", timeout=timeout)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+llm_client: Optional[LLMClient] = None
+
+
+def init_llm_client() -> LLMClient:
+    """Создает общий клиент vLLM (вызывается при старте бота)"""
+    global llm_client
+    if llm_client is None or llm_client.is_closed:
+        llm_client = LLMClient.from_settings()
+        logging.info(
+            f"✅ vLLM client initialized ({settings.vllm_url}, "
+            f"max_connections={settings.vllm_max_connections}, http2={llm_client.http2})"
+        )
+    return llm_client
+
+
+def get_llm_client() -> LLMClient:
+    """Возвращает общий клиент vLLM, создавая его при первом обращении"""
+    if llm_client is None or llm_client.is_closed:
+        return init_llm_client()
+    return llm_client
+
+
+async def close_llm_client():
+    """Закрывает общий клиент vLLM и его соединения"""
+    global llm_client
+    if llm_client is not None:
+        await llm_client.aclose()
+        llm_client = None
+        logging.info("✅ vLLM client closed")
+
+
+Prompt = Union[str, List[Dict[str, str]]]
+
+
+def _build_prompt(parts: PromptParts, team_id: Optional[str] = None) -> Prompt:
+    """
+    Собирает промпт (VLLM_API=completions) или сообщения (VLLM_API=chat)
+    
+    Постоянные части идут первыми, чтобы vLLM переиспользовал KV-кэш префикса;
+    сколько токенов совпало с предыдущими запросами, учитывает prefix_tracker.
+    """
+    prompt = render_prompt(parts)
+    shared = prefix_tracker.observe(prompt, team_id)
+    prompt_tokens.observe(prefix_tracker.last_prompt_tokens)
+    prompt_shared_tokens.observe(shared)
+    set_attributes(prompt_tokens=prefix_tracker.last_prompt_tokens, shared_prefix_tokens=shared)
+    logging.debug(f"Prompt prefix shared with earlier requests: {shared} tokens")
+    if settings.vllm_api == "chat":
+        return render_messages(parts)
+    return prompt
+
+
+def _build_payload(prompt: Prompt, stream: bool = False) -> Dict[str, Any]:
+    payload = {
+        "model": settings.vllm_model_name,
+        "max_tokens": settings.vllm_max_tokens,
+        "temperature": settings.vllm_temperature,
+    }
+    if isinstance(prompt, list):
+        payload["messages"] = prompt
+    else:
+        payload["prompt"] = prompt
+        payload["stop"] = ["</s>", "<|endoftext|>"]
+    if stream:
+        payload["stream"] = True
+    return payload
+
+
+def _choice_text(choice: Dict[str, Any]) -> str:
+    """Текст из choice ответа completions ("text") или chat ("message"/"delta")"""
+    if "text" in choice:
+        return choice.get("text") or ""
+    return (choice.get("message") or choice.get("delta") or {}).get("content") or ""
+
+
+def _status_error(status_code: int) -> Tuple[bool, str]:
+    """
+    Сопоставляет HTTP-статус vLLM с ответом пользователю
+    
+    Returns:
+        (можно ли повторить запрос, сообщение об ошибке)
+    """
+    if status_code == 503:
+        logging.warning("🔄 vLLM server temporarily unavailable")
+        return True, UNAVAILABLE_REPLY
+    if status_code == 422:
+        logging.error("🚫 Invalid request parameters")
+        return False, "❌ Неверные параметры запроса. Обратитесь к администратору."
+    if status_code == 504:
+        logging.error("🕒 Request timeout")
+        return False, "❌ Превышено время ожидания. Попробуйте сократить вопрос."
+    return True, f"❌ Ошибка сервера ИИ: {status_code}. Попробуйте позже."
+
+
+def _record_status(status_code: int):
+    """Учитывает HTTP-ответ vLLM в circuit breaker: 5xx - сбой сервера, остальное - сервер жив"""
+    if status_code >= 500:
+        vllm_breaker.record_failure(f"HTTP {status_code}")
+    else:
+        vllm_breaker.record_success()
+
+
+def _observe_latency(kind: str, seconds: float):
+    """
+    Задержка успешного вызова для адаптивного таймаута и для /metrics
+    
+    kind: "completion" (ответы пользователям), "background" (фоновые генерации,
+    они длиннее и не должны сжимать таймаут ответов) или "first_token"
+    """
+    vllm_breaker.observe(kind, seconds)
+    if kind == "first_token":
+        llm_first_token_seconds.observe(seconds)
+    else:
+        llm_request_seconds.observe(seconds, mode=kind)
+
+
+def _record_timeout(deadline: float):
+    """
+    Учитывает таймаут в circuit breaker. Сбоем считается только таймаут по полному
+    VLLM_TIMEOUT; превышение адаптивного дедлайна (2 x p95) - просто медленный ответ,
+    например под нагрузкой, и breaker из-за него не открывается.
+    """
+    if deadline >= vllm_breaker.max_timeout:
+        vllm_breaker.record_failure("timeout")
+    else:
+        logging.warning(f"⏱️ vLLM exceeded the adaptive {deadline:.1f}s deadline, not counted as a failure")
+
+
+async def _allow_retry(operation: str) -> bool:
+    """Можно ли делать повторную попытку (breaker мог открыться после прошлой)"""
+    try:
+        await vllm_breaker.allow()
+    except CircuitOpen:
+        logging.warning("🔌 vLLM circuit opened, giving up retries")
+        return False
+    retries_total.inc(operation=operation)
+    return True
+
+
+@single_flight()
+async def get_answer(
+    context: str,
+    question: str,
+    team_id: Optional[str] = None,
+    system_message: str = "",
+    summaries: str = "",
+    priority: int = INTERACTIVE
+) -> str:
     """
     Получает ответ от vLLM с обработкой ошибок и повторными попытками
     
+    Запрос ждет свободный слот в llm_scheduler (справедливая очередь по командам);
+    если слот не освободился за LLM_QUEUE_TIMEOUT, возвращается BUSY_REPLY.
+    Пока circuit breaker открыт, сразу возвращается UNAVAILABLE_REPLY.
+    Одновременные одинаковые вопросы одной команды получают одну генерацию.
+    
     Args:
-        context: Контекст для ответа
+        context: Найденная история сообщений для ответа
         question: Вопрос пользователя
+        team_id: Команда, от имени которой идет запрос
+        system_message: Системное сообщение команды
+        summaries: Сводки последних дней команды
+        priority: INTERACTIVE или BACKGROUND
         
     Returns:
         str: Ответ от vLLM или сообщение об ошибке
     """
-    prompt = f"""CONTEXT:
-{context}
-
-QUESTION:
-{question}
+    try:
+        await vllm_breaker.allow()
+        async with llm_scheduler.slot(team_id, priority):
+            parts = PromptParts(question, context, system_message, summaries)
+            return await _request_answer(parts, team_id)
+    except CircuitOpen:
+        return UNAVAILABLE_REPLY
+    except LLMBusy:
+        return BUSY_REPLY
 
-You are a helpful AI assistant for a team. Your name is ChatCopilot. 
-Based on the CONTEXT which contains pieces of conversations from team chats, 
-answer the QUESTION. If the context is not enough, say that you don't have enough information. 
-Respond in Russian language.
 
-ANSWER:"""
+async def _request_answer(parts: PromptParts, team_id: Optional[str] = None) -> str:
+    """Запрос к vLLM с повторными попытками (вызывается, когда слот уже получен)"""
+    prompt = _build_prompt(parts, team_id)
     
     # Подготавливаем данные для запроса
-    payload = {
-        "model": settings.vllm_model_name,
-        "prompt": prompt,
-        "max_tokens": settings.vllm_max_tokens,
-        "temperature": settings.vllm_temperature,
-        "stop": ["</s>", "<|endoftext|>"]
-    }
+    payload = _build_payload(prompt)
     
     max_retries = 3
     retry_delay = 1
+    timed_out = False
     
     for attempt in range(max_retries):
+        if attempt > 0 and not await _allow_retry("llm_answer"):
+            return UNAVAILABLE_REPLY
+        set_attributes(attempts=attempt + 1)
+        # Таймаут подстраивается под p95 задержки; после таймаута повтор ждет полный VLLM_TIMEOUT
+        deadline = vllm_breaker.max_timeout if timed_out else vllm_breaker.timeout("completion")
         try:
             logging.info(f"🤖 vLLM request attempt {attempt + 1}/{max_retries}")
-            logging.debug(f"Question: {question[:100]}...")
-            logging.debug(f"Context length: {len(context)} chars")
-            logging.debug(f"Prompt length: {len(prompt)} chars")
+            logging.debug(f"Question: {parts.question[:100]}...")
+            logging.debug(f"Context length: {len(parts.context)} chars")
             
             # Делаем запрос к vLLM
-            async with httpx.AsyncClient(timeout=settings.vllm_timeout) as client:
-                response = await client.post(
-                    f"{settings.vllm_url}/v1/completions",
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                # Проверяем статус ответа
-                if response.status_code != 200:
-                    logging.error(f"❌ vLLM HTTP error {response.status_code}: {response.text}")
-                    
-                    if response.status_code == 503:
-                        logging.warning("🔄 vLLM server temporarily unavailable")
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            return "❌ Сервер ИИ временно недоступен. Попробуйте позже."
-                    
-                    elif response.status_code == 422:
-                        logging.error("🚫 Invalid request parameters")
-                        return "❌ Неверные параметры запроса. Обратитесь к администратору."
-                    
-                    elif response.status_code == 504:
-                        logging.error("🕒 Request timeout")
-                        return "❌ Превышено время ожидания. Попробуйте сократить вопрос."
-                    
-                    else:
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            return f"❌ Ошибка сервера ИИ: {response.status_code}. Попробуйте позже."
-                
-                # Парсим ответ
-                try:
-                    response_data = response.json()
-                except Exception as e:
-                    logging.error(f"❌ Failed to parse JSON response: {e}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
-                    else:
-                        return "❌ Некорректный ответ от сервера ИИ. Попробуйте позже."
-                
-                # Извлекаем текст ответа
-                if "choices" not in response_data or not response_data["choices"]:
-                    logging.warning("⚠️ vLLM returned empty choices")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
-                    else:
-                        return "❌ Получен пустой ответ от ИИ. Попробуйте переформулировать вопрос."
-                
-                answer_text = response_data["choices"][0].get("text", "").strip()
-                
-                if not answer_text:
-                    logging.warning("⚠️ vLLM returned empty text")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
-                    else:
-                        return "❌ Получен пустой ответ от ИИ. Попробуйте переформулировать вопрос."
-                
-                # Успешный ответ
-                logging.info(f"✅ vLLM response received successfully (length: {len(answer_text)} chars)")
-                
-                # Дополнительная обработка ответа
-                if answer_text.startswith("ANSWER:"):
-                    answer_text = answer_text[7:].strip()
-                
-                return answer_text
+            started = time.monotonic()
+            response = await get_llm_client().post_completion(payload, timeout=deadline)
+            _record_status(response.status_code)
+            set_attributes(status=response.status_code)
+            
+            # Проверяем статус ответа
+            if response.status_code != 200:
+                logging.error(f"❌ vLLM HTTP error {response.status_code}: {response.text}")
                 
+                retryable, error_reply = _status_error(response.status_code)
+                if retryable and attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+                return error_reply
+            
+            # Парсим ответ
+            try:
+                response_data = response.json()
+            except Exception as e:
+                logging.error(f"❌ Failed to parse JSON response: {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+                else:
+                    return "❌ Некорректный ответ от сервера ИИ. Попробуйте позже."
+            
+            # Извлекаем текст ответа
+            if "choices" not in response_data or not response_data["choices"]:
+                logging.warning("⚠️ vLLM returned empty choices")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+                else:
+                    return "❌ Получен пустой ответ от ИИ. Попробуйте переформулировать вопрос."
+            
+            answer_text = _choice_text(response_data["choices"][0]).strip()
+            
+            if not answer_text:
+                logging.warning("⚠️ vLLM returned empty text")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+                else:
+                    return "❌ Получен пустой ответ от ИИ. Попробуйте переформулировать вопрос."
+            
+            # Успешный ответ
+            _observe_latency("completion", time.monotonic() - started)
+            logging.info(f"✅ vLLM response received successfully (length: {len(answer_text)} chars)")
+            
+            # Дополнительная обработка ответа
+            if answer_text.startswith("ANSWER:"):
+                answer_text = answer_text[7:].strip()
+            
+            return answer_text
+            
         except httpx.ConnectError:
             logging.error(f"❌ Connection error to vLLM server on attempt {attempt + 1}")
+            vllm_breaker.record_failure("connection error")
             if attempt < max_retries - 1:
                 logging.info(f"🔄 Retrying connection in {retry_delay} seconds...")
                 await asyncio.sleep(retry_delay)
@@ -138,6 +383,8 @@ ANSWER:"""
         
         except httpx.TimeoutException:
             logging.error(f"❌ Timeout error on attempt {attempt + 1}")
+            _record_timeout(deadline)
+            timed_out = True
             if attempt < max_retries - 1:
                 logging.info(f"🔄 Retrying after timeout in {retry_delay} seconds...")
                 await asyncio.sleep(retry_delay)
@@ -151,6 +398,8 @@ ANSWER:"""
             error_message = str(e)
             
             logging.error(f"❌ vLLM error on attempt {attempt + 1}: {error_type}: {error_message}")
+            if isinstance(e, httpx.HTTPError):
+                vllm_breaker.record_failure(error_type)
             
             if attempt < max_retries - 1:
                 logging.info(f"🔄 Retrying in {retry_delay} seconds...")
@@ -163,6 +412,223 @@ ANSWER:"""
     return "❌ Не удалось получить ответ от ИИ после нескольких попыток."
 
 
+async def _iter_sse_text(response: httpx.Response) -> AsyncIterator[str]:
+    """Разбирает SSE-поток vLLM и отдает текстовые фрагменты"""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        choices = chunk.get("choices") or []
+        text = _choice_text(choices[0]) if choices else ""
+        if text:
+            yield text
+
+
+@single_flight_stream(interrupted=lambda: StreamInterrupted(UNAVAILABLE_REPLY))
+async def stream_answer(
+    context: str,
+    question: str,
+    team_id: Optional[str] = None,
+    system_message: str = "",
+    summaries: str = ""
+) -> AsyncIterator[str]:
+    """
+    Получает ответ от vLLM потоком (SSE), отдавая текст по мере генерации
+    
+    Повторные попытки и сообщения об ошибках такие же, как в get_answer.
+    Повтор возможен только пока пользователю еще ничего не отдано;
+    если поток оборвался посередине, бросается StreamInterrupted.
+    Слот llm_scheduler занят, пока поток не закончится. Пока circuit breaker
+    открыт, сразу отдается UNAVAILABLE_REPLY. Одновременные одинаковые
+    вопросы одной команды читают один и тот же поток.
+    
+    Args:
+        context: Найденная история сообщений для ответа
+        question: Вопрос пользователя
+        team_id: Команда, от имени которой идет запрос
+        system_message: Системное сообщение команды
+        summaries: Сводки последних дней команды
+        
+    Yields:
+        str: Очередной фрагмент ответа или одно сообщение об ошибке
+    """
+    try:
+        await vllm_breaker.allow()
+        await llm_scheduler.acquire(team_id or "default", INTERACTIVE)
+    except CircuitOpen:
+        yield UNAVAILABLE_REPLY
+        return
+    except LLMBusy:
+        yield BUSY_REPLY
+        return
+    try:
+        parts = PromptParts(question, context, system_message, summaries)
+        async for chunk in _stream_answer(parts, team_id):
+            yield chunk
+    finally:
+        llm_scheduler.release()
+
+
+async def _stream_answer(parts: PromptParts, team_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Потоковый запрос к vLLM с повторными попытками (слот уже получен)"""
+    prompt = _build_prompt(parts, team_id)
+    payload = _build_payload(prompt, stream=True)
+    
+    max_retries = 3
+    retry_delay = 1
+    
+    timed_out = False
+    for attempt in range(max_retries):
+        if attempt > 0 and not await _allow_retry("llm_stream"):
+            yield UNAVAILABLE_REPLY
+            return
+        set_attributes(attempts=attempt + 1)
+        # Таймаут чтения подстраивается под p95 времени до первого фрагмента;
+        # после таймаута повтор ждет полный VLLM_TIMEOUT
+        deadline = vllm_breaker.max_timeout if timed_out else vllm_breaker.timeout("first_token")
+        yielded = False
+        error_reply = None
+        try:
+            logging.info(f"🤖 vLLM stream attempt {attempt + 1}/{max_retries}")
+            
+            started = time.monotonic()
+            first_chunk = True
+            async with get_llm_client().stream_completion(payload, timeout=deadline) as response:
+                set_attributes(status=response.status_code)
+                if response.status_code != 200:
+                    await response.aread()
+                    _record_status(response.status_code)
+                    logging.error(f"❌ vLLM HTTP error {response.status_code}: {response.text}")
+                    retryable, error_reply = _status_error(response.status_code)
+                    if not retryable:
+                        yield error_reply
+                        return
+                else:
+                    # Копим начало ответа, чтобы срезать префикс "ANSWER:" и пробелы
+                    head = ""
+                    total_length = 0
+                    async for piece in _iter_sse_text(response):
+                        if first_chunk:
+                            first_chunk = False
+                            _observe_latency("first_token", time.monotonic() - started)
+                            set_attributes(first_token=round(time.monotonic() - started, 3))
+                        if not yielded:
+                            head += piece
+                            stripped = head.lstrip()
+                            if len(stripped) < len("ANSWER:") and "ANSWER:".startswith(stripped):
+                                continue
+                            if stripped.startswith("ANSWER:"):
+                                stripped = stripped[7:].lstrip()
+                            if not stripped:
+                                continue
+                            piece = stripped
+                        yielded = True
+                        total_length += len(piece)
+                        yield piece
+                    
+                    if not yielded and head.strip():
+                        # Очень короткий ответ целиком попал в буфер начала
+                        yielded = True
+                        total_length = len(head.strip())
+                        yield head.strip()
+                    
+                    # Поток дочитан до конца: сервер работает, даже если текст пустой
+                    vllm_breaker.record_success()
+                    if yielded:
+                        llm_request_seconds.observe(time.monotonic() - started, mode="stream")
+                        logging.info(f"✅ vLLM stream finished successfully (length: {total_length} chars)")
+                        return
+                    
+                    logging.warning("⚠️ vLLM returned empty text")
+                    error_reply = "❌ Получен пустой ответ от ИИ. Попробуйте переформулировать вопрос."
+        
+        except httpx.ConnectError:
+            logging.error(f"❌ Connection error to vLLM server on attempt {attempt + 1}")
+            vllm_breaker.record_failure("connection error")
+            error_reply = "❌ Не удалось подключиться к серверу ИИ. Проверьте, что vLLM запущен."
+        
+        except httpx.TimeoutException:
+            logging.error(f"❌ Timeout error on attempt {attempt + 1}")
+            _record_timeout(deadline)
+            timed_out = True
+            error_reply = "❌ Превышено время ожидания. Попробуйте сократить вопрос."
+        
+        except Exception as e:
+            error_type = type(e).__name__
+            logging.error(f"❌ vLLM stream error on attempt {attempt + 1}: {error_type}: {e}")
+            if isinstance(e, httpx.HTTPError):
+                vllm_breaker.record_failure(error_type)
+            error_reply = f"❌ Неизвестная ошибка ИИ: {error_type}. Попробуйте позже."
+        
+        if yielded:
+            # Часть ответа уже у пользователя, повтор продублировал бы текст
+            logging.warning("⚠️ vLLM stream interrupted after partial answer")
+            raise StreamInterrupted(error_reply)
+        
+        if attempt < max_retries - 1:
+            logging.info(f"🔄 Retrying in {retry_delay} seconds...")
+            await asyncio.sleep(retry_delay)
+            retry_delay *= 2
+            continue
+        
+        yield error_reply
+        return
+
+
+class LLMError(Exception):
+    """vLLM не вернул текст (для фоновых задач, которым нужна ошибка, а не ответ пользователю)"""
+
+
+async def generate_text(
+    prompt: str,
+    max_tokens: Optional[int] = None,
+    team_id: Optional[str] = None,
+    priority: int = BACKGROUND
+) -> str:
+    """
+    Одна генерация по готовому промпту, без повторов
+    
+    В отличие от get_answer, при ошибке бросает LLMError: фоновые задачи
+    (суммаризация) сами решают, когда повторить. По умолчанию идет с фоновым
+    приоритетом, пропуская вперед вопросы пользователей.
+    """
+    payload = _build_payload([{"role": "user", "content": prompt}] if settings.vllm_api == "chat" else prompt)
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    # Фоновые генерации длиннее ответов, их задержки учитываются отдельно
+    kind = "background" if priority == BACKGROUND else "completion"
+    deadline = vllm_breaker.timeout(kind)
+    try:
+        await vllm_breaker.allow()
+        async with llm_scheduler.slot(team_id, priority):
+            started = time.monotonic()
+            response = await get_llm_client().post_completion(payload, timeout=deadline)
+    except (CircuitOpen, LLMBusy) as e:
+        raise LLMError(str(e)) from e
+    except httpx.TimeoutException as e:
+        _record_timeout(deadline)
+        raise LLMError(f"{type(e).__name__}: {e}") from e
+    except httpx.HTTPError as e:
+        vllm_breaker.record_failure(type(e).__name__)
+        raise LLMError(f"{type(e).__name__}: {e}") from e
+    
+    _record_status(response.status_code)
+    if response.status_code != 200:
+        raise LLMError(f"vLLM HTTP error {response.status_code}: {response.text[:200]}")
+    try:
+        choices = response.json().get("choices") or []
+    except ValueError as e:
+        raise LLMError(f"Failed to parse JSON response: {e}") from e
+    text = _choice_text(choices[0]).strip() if choices else ""
+    if not text:
+        raise LLMError("vLLM returned empty text")
+    _observe_latency(kind, time.monotonic() - started)
+    return text
+
+
 async def check_vllm_health() -> Dict[str, Any]:
     """
     Проверяет состояние vLLM сервера
@@ -171,25 +637,24 @@ async def check_vllm_health() -> Dict[str, Any]:
         Dict с информацией о состоянии сервера
     """
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            # Проверяем health endpoint
-            response = await client.get(f"{settings.vllm_url}/health")
+        # Проверяем health endpoint
+        response = await get_llm_client().get_health(timeout=10)
+        
+        if response.status_code == 200:
+            return {
+                "status": "healthy",
+                "url": settings.vllm_url,
+                "model": settings.vllm_model_name,
+                "message": "vLLM server is running"
+            }
+        else:
+            return {
+                "status": "unhealthy",
+                "url": settings.vllm_url,
+                "model": settings.vllm_model_name,
+                "message": f"Health check failed: {response.status_code}"
+            }
             
-            if response.status_code == 200:
-                return {
-                    "status": "healthy",
-                    "url": settings.vllm_url,
-                    "model": settings.vllm_model_name,
-                    "message": "vLLM server is running"
-                }
-            else:
-                return {
-                    "status": "unhealthy",
-                    "url": settings.vllm_url,
-                    "model": settings.vllm_model_name,
-                    "message": f"Health check failed: {response.status_code}"
-                }
-                
     except httpx.ConnectError:
         return {
             "status": "connection_error",
@@ -0,0 +1,144 @@
+import logging
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from src.services.tracing import span
+from src.settings import settings
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class LLMBusy(Exception):
+    """No vLLM slot became free within the queue timeout"""
+
+
+class LLMScheduler:
+    """
+    Admission control in front of vLLM.
+
+    At most max_in_flight requests run at once; the rest wait in per-priority
+    queues. Interactive requests are always admitted before background ones,
+    and within a priority teams take turns (round robin), so one busy team
+    cannot starve the others. A waiter that is not admitted within the queue
+    timeout of its priority gets LLMBusy (0 = wait indefinitely).
+    """
+
+    def __init__(self, max_in_flight: int, queue_timeout: float, background_queue_timeout: float = 0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_timeouts = {INTERACTIVE: queue_timeout, BACKGROUND: background_queue_timeout}
+        self.in_flight = 0
+        # priority -> team -> waiters; a team moves to the back after each admission
+        self._queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            INTERACTIVE: OrderedDict(),
+            BACKGROUND: OrderedDict(),
+        }
+
+        self.admitted = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.timeouts = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._waits: Dict[int, Deque[float]] = {INTERACTIVE: deque(maxlen=1000), BACKGROUND: deque(maxlen=1000)}
+
+    def queued(self, priority: Optional[int] = None) -> int:
+        priorities = [priority] if priority is not None else list(self._queues)
+        return sum(len(waiters) for p in priorities for waiters in self._queues[p].values())
+
+    def _remove(self, priority: int, team_id: str, future: asyncio.Future):
+        waiters = self._queues[priority].get(team_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[priority][team_id]
+
+    def _dispatch(self):
+        """Admit waiters while there are free slots"""
+        for priority in (INTERACTIVE, BACKGROUND):
+            queue = self._queues[priority]
+            while queue and self.in_flight < self.max_in_flight:
+                team_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(team_id)
+                else:
+                    del queue[team_id]
+                if future.done():
+                    continue
+                self.in_flight += 1
+                future.set_result(None)
+
+    async def acquire(self, team_id: str, priority: int = INTERACTIVE):
+        loop = asyncio.get_running_loop()
+        if self.in_flight < self.max_in_flight and self.queued() == 0:
+            self.in_flight += 1
+            self.admitted[priority] += 1
+            self._waits[priority].append(0.0)
+            return
+
+        started = loop.time()
+        future = loop.create_future()
+        self._queues[priority].setdefault(team_id, deque()).append(future)
+        timeout = self.queue_timeouts[priority] or None
+        try:
+            with span("llm.queue", priority=PRIORITY_NAMES[priority], in_flight=self.in_flight, queued=self.queued()):
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._remove(priority, team_id, future)
+                future.cancel()
+                self.timeouts[priority] += 1
+                logging.warning(
+                    f"⏳ LLM queue timeout for team {team_id} ({PRIORITY_NAMES[priority]}, "
+                    f"{self.in_flight} in flight, {self.queued()} queued)"
+                )
+                raise LLMBusy(f"no LLM slot within {timeout}s")
+            # Admitted at the very moment the timeout fired: keep the slot
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._remove(priority, team_id, future)
+                future.cancel()
+            raise
+        self.admitted[priority] += 1
+        self._waits[priority].append(loop.time() - started)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, team_id: Optional[str] = None, priority: int = INTERACTIVE) -> AsyncIterator[None]:
+        """Hold one vLLM slot for the duration of the block"""
+        await self.acquire(team_id or "default", priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = sorted(self._waits[priority])
+            result[name] = {
+                "queued": self.queued(priority),
+                "teams_waiting": len(self._queues[priority]),
+                "admitted": self.admitted[priority],
+                "timeouts": self.timeouts[priority],
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait": waits[max(0, int(len(waits) * 0.95) - 1)] if waits else 0.0,
+                "max_wait": waits[-1] if waits else 0.0,
+            }
+        return result
+
+
+llm_scheduler = LLMScheduler(
+    max_in_flight=settings.llm_max_in_flight,
+    queue_timeout=settings.llm_queue_timeout,
+    background_queue_timeout=settings.llm_background_queue_timeout,
+)
@@ -0,0 +1,326 @@
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from src.settings import settings
+
+# Seconds, from a cache-speed DB lookup to a long generation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# (metric name, type, help, [(labels, value), ...]) produced at scrape time
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic counter; by convention the name ends with _total"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed upper bounds, as Prometheus expects"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [per-bucket counts (not cumulative), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self):
+        for key, (counts, total, count) in self._series.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process in the Prometheus text format.
+
+    Besides the metrics updated in place, collectors are called on every
+    scrape to export counters the services already keep (cache hits, queue
+    sizes, breaker state) without touching their hot paths.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, kind: str, documentation: str):
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for metric in self._metrics.values():
+            header(metric.name, metric.type, metric.documentation)
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logging.warning(f"⚠️ Metrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                header(name, kind, documentation)
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Metrics updated by the services ------------------------------------------
+
+db_request_seconds = Histogram(
+    "chatcopilot_db_request_seconds",
+    "Supabase round-trip time by supabase_client function",
+    ["function"],
+)
+db_errors_total = Counter(
+    "chatcopilot_db_errors_total",
+    "Supabase requests that raised, by supabase_client function",
+    ["function"],
+)
+retrieval_seconds = Histogram(
+    "chatcopilot_retrieval_seconds",
+    "Retrieval time by stage (fts, vector, hybrid, expand)",
+    ["stage"],
+)
+prompt_tokens = Histogram(
+    "chatcopilot_prompt_tokens",
+    "Size of Q&A prompts sent to vLLM, in tokens",
+    buckets=TOKEN_BUCKETS,
+)
+prompt_shared_tokens = Histogram(
+    "chatcopilot_prompt_shared_tokens",
+    "Leading prompt tokens shared with an earlier prompt (reusable by the prefix cache)",
+    buckets=TOKEN_BUCKETS,
+)
+llm_request_seconds = Histogram(
+    "chatcopilot_llm_request_seconds",
+    "Duration of successful vLLM calls, by mode (completion, background, stream)",
+    ["mode"],
+)
+llm_first_token_seconds = Histogram(
+    "chatcopilot_llm_first_token_seconds",
+    "Time from sending a streamed vLLM request to its first text chunk",
+)
+chat_question_seconds = Histogram(
+    "chatcopilot_chat_question_seconds",
+    "Total handling time of a Q&A question, by outcome (answered, cached, interrupted, busy, unavailable, error)",
+    ["outcome"],
+)
+ingested_messages_total = Counter(
+    "chatcopilot_ingested_messages_total",
+    "Chat messages saved by the ingestion queue, by team",
+    ["team_id"],
+)
+retries_total = Counter(
+    "chatcopilot_retries_total",
+    "Retried attempts, by operation",
+    ["operation"],
+)
+
+
+# --- Counters the services keep themselves, read on scrape --------------------
+
+def _service_metrics() -> Iterable[Family]:
+    # Imported lazily: the services import this module for the metrics above
+    from src.services.supabase_client import get_routing_cache_stats, get_team_cache_stats
+    from src.services.answer_cache import answer_cache
+    from src.services.hot_window import hot_window
+    from src.services.ingestion_queue import ingestion_queue
+    from src.services.llm_scheduler import llm_scheduler, PRIORITY_NAMES, INTERACTIVE, BACKGROUND
+    from src.services.circuit_breaker import vllm_breaker, CLOSED, HALF_OPEN, OPEN
+    from src.services.single_flight import single_flight_stats
+
+    caches = {
+        "routing": get_routing_cache_stats(),
+        "team": get_team_cache_stats(),
+        "answer": answer_cache.stats(),
+    }
+    yield ("chatcopilot_cache_hits_total", "counter", "Cache hits, by cache",
+           [({"cache": name}, stats["hits"]) for name, stats in caches.items()]
+           + [({"cache": "hot_window"}, hot_window.hits)])
+    yield ("chatcopilot_cache_misses_total", "counter", "Cache misses, by cache",
+           [({"cache": name}, stats["misses"]) for name, stats in caches.items()]
+           + [({"cache": "hot_window"}, hot_window.misses)])
+    yield ("chatcopilot_cache_entries", "gauge", "Entries held, by cache",
+           [({"cache": name}, stats["size"]) for name, stats in caches.items()]
+           + [({"cache": "hot_window"}, len(hot_window))])
+
+    yield ("chatcopilot_ingestion_queue_size", "gauge", "Messages waiting in the ingestion queue",
+           [({}, ingestion_queue.qsize())])
+    yield ("chatcopilot_ingestion_dropped_total", "counter", "Messages dropped after all save attempts failed",
+           [({}, ingestion_queue.dropped_rows)])
+    yield ("chatcopilot_ingestion_unindexed", "gauge", "Saved messages waiting for vector indexing",
+           [({}, ingestion_queue.unindexed_rows)])
+
+    yield ("chatcopilot_llm_in_flight", "gauge", "vLLM requests running now",
+           [({}, llm_scheduler.in_flight)])
+    yield ("chatcopilot_llm_queued", "gauge", "Requests waiting for a vLLM slot, by priority",
+           [({"priority": PRIORITY_NAMES[p]}, llm_scheduler.queued(p)) for p in (INTERACTIVE, BACKGROUND)])
+    yield ("chatcopilot_llm_queue_timeouts_total", "counter", "Requests that got no vLLM slot in time, by priority",
+           [({"priority": PRIORITY_NAMES[p]}, llm_scheduler.timeouts[p]) for p in (INTERACTIVE, BACKGROUND)])
+
+    yield ("chatcopilot_llm_circuit_state", "gauge", "vLLM circuit breaker state (0 closed, 1 half open, 2 open)",
+           [({}, {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[vllm_breaker.state])])
+    yield ("chatcopilot_llm_circuit_rejected_total", "counter", "Calls rejected while the vLLM circuit was open",
+           [({}, vllm_breaker.rejected)])
+
+    flights = single_flight_stats()
+    yield ("chatcopilot_single_flight_shared_total", "counter", "Calls served by an identical call in flight, by function",
+           [({"function": name}, stats["shared"]) for name, stats in flights.items()])
+
+
+registry.register_collector(_service_metrics)
+
+
+# --- HTTP endpoint -----------------------------------------------------------
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=registry.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_metrics_server():
+    """Serve GET /metrics on METRICS_HOST:METRICS_PORT (both polling and webhook mode)"""
+    global _runner
+    if not settings.metrics_enabled or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=settings.metrics_host, port=settings.metrics_port).start()
+    except OSError as e:
+        # Metrics are optional, the bot keeps running without them
+        logging.error(f"❌ Failed to start metrics endpoint on port {settings.metrics_port}: {e}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    logging.info(f"📈 Metrics available at http://{settings.metrics_host}:{settings.metrics_port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
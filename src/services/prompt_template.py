@@ -0,0 +1,124 @@
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from src.services.context_packer import count_tokens, truncate_to_tokens
+from src.settings import settings
+
+# Fixed for every request, so it always opens the prompt
+INSTRUCTIONS = """You are a helpful AI assistant for a team. Your name is ChatCopilot.
+Based on the CONTEXT which contains pieces of conversations from team chats,
+answer the QUESTION. Use the TEAM INSTRUCTIONS and the TEAM SUMMARIES as background.
+If the context is not enough, say that you don't have enough information.
+Respond in Russian language."""
+
+
+class PromptParts(NamedTuple):
+    """
+    Parts of a Q&A prompt, from the most stable to the most volatile.
+
+    vLLM reuses the KV cache of the longest prompt prefix it has already seen,
+    so parts shared by many requests (instructions, then the team system
+    message, then the daily summaries that change once a day) come first, and
+    the retrieved context and the question, which change every time, come last.
+    """
+    question: str
+    context: str = ""
+    system_message: str = ""
+    summaries: str = ""
+
+    def stable(self) -> str:
+        sections = [INSTRUCTIONS]
+        if self.system_message:
+            sections.append(f"TEAM INSTRUCTIONS:\n{self.system_message.strip()}")
+        if self.summaries:
+            sections.append(f"TEAM SUMMARIES:\n{self.summaries.strip()}")
+        return "\n\n".join(sections)
+
+    def volatile(self) -> str:
+        return f"CONTEXT:\n{self.context}\n\nQUESTION:\n{self.question}"
+
+
+def render_prompt(parts: PromptParts) -> str:
+    """Prompt for /v1/completions"""
+    return f"{parts.stable()}\n\n{parts.volatile()}\n\nANSWER:"
+
+
+def render_messages(parts: PromptParts) -> List[Dict[str, str]]:
+    """Messages for /v1/chat/completions: stable parts as the system message"""
+    return [
+        {"role": "system", "content": parts.stable()},
+        {"role": "user", "content": parts.volatile()},
+    ]
+
+
+def format_summaries(rows: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> str:
+    """
+    Daily summaries as "date: summary" lines, oldest first.
+
+    The oldest days are dropped until the rest fits into max_tokens, so a new
+    day only changes the prompt from the summaries section on.
+    """
+    max_tokens = settings.prompt_summary_max_tokens if max_tokens is None else max_tokens
+    lines = [
+        f"{row['date']}: {row['summary'].strip()}"
+        for row in sorted(rows, key=lambda row: row["date"])
+        if (row.get("summary") or "").strip()
+    ]
+    while lines and count_tokens("\n".join(lines)) > max_tokens:
+        if len(lines) == 1:
+            return truncate_to_tokens(lines[0], max_tokens)
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class PrefixTracker:
+    """
+    Measures how much of each prompt repeats the start of an earlier one.
+
+    A prompt is compared with the previous prompt overall and with the previous
+    prompt of the same team; the longer common prefix is what vLLM's prefix
+    cache can reuse at best.
+    """
+
+    def __init__(self, max_teams: int = 1000):
+        self.max_teams = max_teams
+        self._last: Optional[str] = None
+        self._last_by_team: "OrderedDict[str, str]" = OrderedDict()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.shared_tokens = 0
+        self.last_shared_tokens = 0
+        self.last_prompt_tokens = 0
+
+    def observe(self, prompt: str, team_id: Optional[str] = None) -> int:
+        """Record a prompt, return the number of its leading tokens seen before"""
+        earlier = [p for p in (self._last, self._last_by_team.get(team_id)) if p]
+        shared_chars = max((len(os.path.commonprefix([prompt, p])) for p in earlier), default=0)
+        shared = count_tokens(prompt[:shared_chars])
+
+        self._last = prompt
+        if team_id is not None:
+            self._last_by_team[team_id] = prompt
+            self._last_by_team.move_to_end(team_id)
+            while len(self._last_by_team) > self.max_teams:
+                self._last_by_team.popitem(last=False)
+
+        self.requests += 1
+        self.last_prompt_tokens = count_tokens(prompt)
+        self.prompt_tokens += self.last_prompt_tokens
+        self.shared_tokens += shared
+        self.last_shared_tokens = shared
+        return shared
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+            "avg_shared_tokens": self.shared_tokens / self.requests if self.requests else 0.0,
+            "shared_ratio": self.shared_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "last_shared_tokens": self.last_shared_tokens,
+        }
+
+
+prefix_tracker = PrefixTracker()
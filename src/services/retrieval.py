@@ -0,0 +1,159 @@
+import logging
+import asyncio
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple
+
+from src.services.supabase_client import search_messages_by_text, get_messages_in_windows
+from src.services.vector_db import get_embedding, query_vectors, embedding_model_manager
+from src.services.metrics import retrieval_seconds
+from src.services.tracing import span
+from src.settings import settings
+
+
+def message_key(message: Dict[str, Any]) -> Any:
+    """Identity of a message across retrieval legs"""
+    if message.get("chat_id") is not None and message.get("message_id") is not None:
+        return (message["chat_id"], message["message_id"])
+    if message.get("id") is not None:
+        return message["id"]
+    return message.get("text")
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Merge ranked lists: each message scores sum(1 / (k + rank)) over the lists
+    it appears in. The first list that returned a message provides its dict.
+    """
+    scores: Dict[Any, float] = {}
+    messages: Dict[Any, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, message in enumerate(results, start=1):
+            key = message_key(message)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            messages.setdefault(key, message)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [messages[key] for key in ranked]
+
+
+async def _within_budget(
+    leg: str, stage: str, awaitable: Awaitable[List[Dict[str, Any]]], timeout: float
+) -> List[Dict[str, Any]]:
+    """Run one retrieval leg; a slow or failing leg returns nothing instead of raising"""
+    try:
+        with retrieval_seconds.time(stage=stage), span(f"search.{stage}") as leg_span:
+            results = await asyncio.wait_for(awaitable, timeout)
+            if leg_span:
+                leg_span.set(results=len(results))
+            return results
+    except asyncio.TimeoutError:
+        logging.warning(f"⏱️ {leg} search exceeded its {timeout}s budget, using the other results only")
+    except Exception as e:
+        logging.warning(f"⚠️ {leg} search failed: {e}")
+    return []
+
+
+async def _vector_search(team_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+    if not embedding_model_manager.is_ready:
+        # Loading the model does not fit a Q&A budget, make sure it is on its way
+        embedding_model_manager.start_warmup()
+        return []
+    vector = await get_embedding(query)
+    matches = await query_vectors(team_id, vector, top_k=limit)
+    # Only message vectors carry the source row, other vectors (tests, summaries) are skipped
+    return [match["metadata"] for match in matches if match.get("metadata")]
+
+
+async def hybrid_search(team_id: str, query: str, limit: int = 7, candidates: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Full-text and vector search run concurrently, merged with reciprocal rank fusion.
+
+    Returns up to ``limit`` message dicts, deduplicated by message, in the same
+    shape search_messages_by_text returns.
+    """
+    candidates = max(limit, candidates or settings.retrieval_candidates)
+    with retrieval_seconds.time(stage="hybrid"):
+        fts_results, vector_results = await asyncio.gather(
+            _within_budget(
+                "Full-text", "fts", search_messages_by_text(team_id, query, limit=candidates), settings.retrieval_fts_timeout
+            ),
+            _within_budget("Vector", "vector", _vector_search(team_id, query, candidates), settings.retrieval_vector_timeout),
+        )
+    fused = reciprocal_rank_fusion([fts_results, vector_results], k=settings.retrieval_rrf_k)
+    logging.info(
+        f"🔍 Hybrid search for team {team_id}: {len(fts_results)} full-text + {len(vector_results)} vector "
+        f"-> {len(fused)} unique messages"
+    )
+    return fused[:limit]
+
+
+def merge_windows(hits: List[Dict[str, Any]], radius: int) -> List[Tuple[int, int, int]]:
+    """Turn hits into (chat_id, first_message_id, last_message_id) windows, merging overlaps"""
+    by_chat: Dict[int, List[int]] = {}
+    for hit in hits:
+        if hit.get("chat_id") is not None and hit.get("message_id") is not None:
+            by_chat.setdefault(hit["chat_id"], []).append(hit["message_id"])
+
+    windows = []
+    for chat_id, message_ids in by_chat.items():
+        first = last = None
+        for message_id in sorted(set(message_ids)):
+            if last is not None and message_id - radius <= last + 1:
+                last = message_id + radius
+                continue
+            if last is not None:
+                windows.append((chat_id, first, last))
+            first, last = message_id - radius, message_id + radius
+        windows.append((chat_id, first, last))
+    return windows
+
+
+async def expand_with_neighbors(team_id: str, hits: List[Dict[str, Any]], radius: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Expand each hit to the conversation around it: +-radius messages of the
+    same chat, fetched for all hits in one query.
+
+    Returns snippets {"chat_id", "messages", "hits"} in the order of their best
+    hit; messages of a snippet are in conversation order and "hits" holds the
+    message keys that were retrieved. Hits without a chat/message id, or whose
+    window could not be fetched, become single-message snippets.
+    """
+    radius = settings.retrieval_neighbor_window if radius is None else radius
+    windows = merge_windows(hits, radius) if radius > 0 else []
+    with retrieval_seconds.time(stage="expand"):
+        rows = await get_messages_in_windows(team_id, windows) if windows else []
+
+    rows_by_window: Dict[Tuple[int, int, int], List[Dict[str, Any]]] = {window: [] for window in windows}
+    for row in rows:
+        for window in windows:
+            chat_id, first_id, last_id = window
+            if row.get("chat_id") == chat_id and first_id <= row.get("message_id", first_id - 1) <= last_id:
+                rows_by_window[window].append(row)
+                break
+
+    snippets: List[Dict[str, Any]] = []
+    snippet_by_window: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+    for hit in hits:
+        key = message_key(hit)
+        window = next(
+            (w for w in windows if hit.get("chat_id") == w[0] and w[1] <= hit.get("message_id", w[1] - 1) <= w[2]),
+            None,
+        )
+        if window is None:
+            snippets.append({"chat_id": hit.get("chat_id"), "messages": [hit], "hits": {key}})
+            continue
+
+        snippet = snippet_by_window.get(window)
+        if snippet is None:
+            snippet = {"chat_id": window[0], "messages": rows_by_window[window], "hits": set()}
+            snippet_by_window[window] = snippet
+            snippets.append(snippet)
+        snippet["hits"].add(key)
+        if all(message_key(row) != key for row in snippet["messages"]):
+            # The window query failed or missed the row, keep the hit itself
+            snippet["messages"].append(hit)
+            snippet["messages"].sort(key=lambda row: row.get("message_id", 0))
+
+    logging.info(
+        f"🧩 Expanded {len(hits)} hits to {len(snippets)} snippets "
+        f"({sum(len(snippet['messages']) for snippet in snippets)} messages, radius {radius})"
+    )
+    return snippets
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+# Every group created by the decorators, by function name, for diagnostics
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+def _default_key(*args, **kwargs) -> Hashable:
+    return args, tuple(sorted(kwargs.items()))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller starts the call in its own task; callers arriving while
+    it runs await the same task and get the same result or exception. The
+    call runs to completion even if the caller that started it is cancelled.
+    Nothing is cached: once the call finishes, the next caller starts anew.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, call: Any):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.get_running_loop().create_task(fn(), name=f"single-flight:{self.name}")
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.calls + self.shared
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": self.in_flight,
+            "shared_rate": self.shared / total if total else 0.0,
+        }
+
+
+class _Broadcast:
+    """
+    One running async iterator whose items are replayed to every subscriber.
+    A source that was cancelled midway raises interrupted() in the
+    subscribers (or its CancelledError, when interrupted is not given), so
+    they do not take the partial stream for a complete one.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], interrupted: Optional[Callable[[], BaseException]] = None):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._interrupted = interrupted
+        self._changed = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._changed.set()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if isinstance(self.error, asyncio.CancelledError) and self._interrupted is not None:
+                    raise self._interrupted()
+                if self.error is not None:
+                    raise self.error
+                return
+            self._changed.clear()
+            # Re-check after clearing so an item added in between is not missed
+            if position < len(self.items) or self.done:
+                continue
+            await self._changed.wait()
+
+
+class SingleFlightStream(SingleFlight):
+    """
+    SingleFlight for async generators: concurrent subscribers share one stream.
+    When the last subscriber goes away before the end, the stream is cancelled.
+    """
+
+    def __init__(self, name: str, interrupted: Optional[Callable[[], BaseException]] = None):
+        super().__init__(name)
+        self.interrupted = interrupted
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        broadcast = self._calls.get(key)
+        if broadcast is None:
+            self.calls += 1
+            broadcast = _Broadcast(fn(), self.interrupted)
+            self._calls[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._forget(key, broadcast))
+        else:
+            self.shared += 1
+        broadcast.subscribers += 1
+        try:
+            async for item in broadcast.subscribe():
+                yield item
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                # Nobody reads the stream any more; later callers start a new one
+                self._forget(key, broadcast)
+                broadcast.task.cancel()
+
+
+def single_flight(key: Optional[Callable[..., Hashable]] = None):
+    """
+    Decorator for coroutine functions: concurrent calls with equal arguments
+    (or equal ``key(*args, **kwargs)``) share one execution
+    """
+    make_key = key or _default_key
+
+    def decorator(fn):
+        group = SingleFlight(fn.__qualname__)
+        _groups[fn.__qualname__] = group
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await group.do(make_key(*args, **kwargs), lambda: fn(*args, **kwargs))
+
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorator
+
+
+def single_flight_stream(
+    key: Optional[Callable[..., Hashable]] = None,
+    interrupted: Optional[Callable[[], BaseException]] = None,
+):
+    """
+    Decorator for async generator functions, see single_flight. ``interrupted()``
+    is raised in the subscribers when the shared stream is cancelled midway.
+    """
+    make_key = key or _default_key
+
+    def decorator(fn):
+        group = SingleFlightStream(fn.__qualname__, interrupted)
+        _groups[fn.__qualname__] = group
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            async for item in group.stream(make_key(*args, **kwargs), lambda: fn(*args, **kwargs)):
+                yield item
+
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorator
+
+
+def single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters of every coalesced function"""
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,220 @@
+import logging
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+
+from src.services.context_packer import count_tokens, truncate_to_tokens
+from src.services.llm import generate_text
+from src.services.supabase_client import (
+    get_all_team_ids,
+    get_messages_between,
+    get_summarized_dates,
+    save_daily_summary,
+)
+from src.settings import settings
+
+SUMMARY_PROMPT = """Ты — ИИ-аналитик. Сделай краткую сводку (резюме) по следующему диалогу. Выдели основные темы обсуждения, принятые решения и поставленные задачи.
+
+{dialog}
+
+Сводка:"""
+
+REDUCE_PROMPT = """Ты — ИИ-аналитик. Ниже сводки последовательных частей одного дня переписки команды. Объедини их в одну краткую сводку дня. Выдели основные темы обсуждения, принятые решения и поставленные задачи, без повторов.
+
+{dialog}
+
+Сводка:"""
+
+
+def _chunk_lines(lines: List[str], max_tokens: int) -> List[str]:
+    """Group lines into chunks of at most max_tokens, never splitting a line"""
+    chunks, current, current_tokens = [], [], 0
+    for line in lines:
+        line = truncate_to_tokens(line, max_tokens)
+        line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+async def summarize_lines(lines: List[str], max_tokens: Optional[int] = None, team_id: Optional[str] = None) -> str:
+    """
+    Summarize a dialog map-reduce style: a dialog that does not fit one prompt
+    is cut into chunks, each chunk is summarized, and the partial summaries are
+    summarized again until a single one is left.
+    """
+    max_tokens = settings.summary_chunk_tokens if max_tokens is None else max_tokens
+
+    async def summarize(template: str, dialog: str) -> str:
+        return await generate_text(template.format(dialog=dialog), max_tokens=settings.summary_max_tokens, team_id=team_id)
+
+    chunks = _chunk_lines(lines, max_tokens)
+    if len(chunks) == 1:
+        return await summarize(SUMMARY_PROMPT, chunks[0])
+
+    logging.info(f"📝 Dialog split into {len(chunks)} chunks for summarization")
+    partials = [await summarize(SUMMARY_PROMPT, chunk) for chunk in chunks]
+    while True:
+        chunks = _chunk_lines(partials, max_tokens)
+        if len(chunks) == 1:
+            return await summarize(REDUCE_PROMPT, chunks[0])
+        if len(chunks) == len(partials):
+            # Every partial summary fills a chunk on its own, another round would not shrink them
+            return "\n\n".join(partials)
+        partials = [await summarize(REDUCE_PROMPT, chunk) for chunk in chunks]
+
+
+class SummaryScheduler:
+    """
+    In-process scheduler of daily team summaries.
+
+    Every interval it looks at the last backfill_days finished (UTC) days of
+    every team and summarizes the ones that have no row in daily_summaries yet,
+    at most max_concurrency jobs at a time. A finished day is persisted, so a
+    restart only picks up the days that are still missing.
+    """
+
+    def __init__(self, interval: float, initial_delay: float, backfill_days: int, max_concurrency: int):
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.backfill_days = backfill_days
+        self.max_concurrency = max_concurrency
+
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.runs = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.last_run: Optional[datetime] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._run(), name="summary-scheduler")
+        logging.info(
+            f"✅ Summary scheduler started (every {self.interval:.0f}s, "
+            f"{self.backfill_days} day(s) back, {self.max_concurrency} concurrent jobs)"
+        )
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logging.info("✅ Summary scheduler stopped")
+
+    async def _run(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"❌ Summary run failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def _due_days(self, today: date) -> List[date]:
+        return [today - timedelta(days=offset) for offset in range(self.backfill_days, 0, -1)]
+
+    async def _pending_jobs(self, today: date) -> List[Tuple[str, date]]:
+        days = self._due_days(today)
+        jobs = []
+        for team_id in await get_all_team_ids():
+            try:
+                done = set(await get_summarized_dates(team_id, days[0].isoformat()))
+            except Exception as e:
+                # Without the list of finished days we could redo them all, try next run
+                logging.error(f"❌ Failed to read summaries of team {team_id}: {e}")
+                continue
+            jobs.extend((team_id, day) for day in days if day.isoformat() not in done)
+        return jobs
+
+    async def run_once(self, today: Optional[date] = None) -> Dict[str, int]:
+        """Summarize every missing team day once; returns job counters"""
+        today = today or datetime.now(timezone.utc).date()
+        jobs = await self._pending_jobs(today) if self.backfill_days > 0 else []
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        results = await asyncio.gather(*(self._run_job(team_id, day) for team_id, day in jobs))
+        self.runs += 1
+        self.last_run = datetime.now(timezone.utc)
+        counters = {
+            "jobs": len(jobs),
+            "summarized": results.count("summarized"),
+            "empty": results.count("empty"),
+            "failed": results.count("failed"),
+        }
+        if jobs:
+            logging.info(f"📝 Summary run finished: {counters}")
+        return counters
+
+    async def _run_job(self, team_id: str, day: date) -> str:
+        async with self._semaphore:
+            try:
+                return await self.summarize_day(team_id, day)
+            except Exception as e:
+                self.failed_jobs += 1
+                logging.error(f"❌ Summary of team {team_id} for {day} failed, will retry next run: {e}")
+                return "failed"
+
+    async def summarize_day(self, team_id: str, day: date) -> str:
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        messages = await get_messages_between(team_id, start.isoformat(), end.isoformat())
+        lines = [
+            f"{msg.get('user_name', 'Unknown')}: {msg['text'].strip()}"
+            for msg in messages
+            if (msg.get("text") or "").strip()
+        ]
+        if not lines:
+            # Nothing to store; a quiet day costs one query per run until it leaves the backfill window
+            return "empty"
+
+        logging.info(f"📝 Summarizing {len(lines)} messages of team {team_id} for {day}")
+        summary = await summarize_lines(lines, team_id=team_id)
+        if not await save_daily_summary(team_id, day.isoformat(), summary, len(lines)):
+            raise RuntimeError("summary could not be saved")
+        self.completed_jobs += 1
+        return "summarized"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "completed_jobs": self.completed_jobs,
+            "failed_jobs": self.failed_jobs,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
+
+
+summary_scheduler = SummaryScheduler(
+    interval=settings.summary_interval_seconds,
+    initial_delay=settings.summary_initial_delay_seconds,
+    backfill_days=settings.summary_backfill_days,
+    max_concurrency=settings.summary_max_concurrency,
+)
+
+
+def start_summary_scheduler():
+    """Start the daily summary scheduler if it is enabled"""
+    if settings.summary_enabled:
+        summary_scheduler.start()
+
+
+async def stop_summary_scheduler():
+    await summary_scheduler.stop()
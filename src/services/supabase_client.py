@@ -1,33 +1,94 @@
 import logging
 import asyncio
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+
+from src.services.cache import TTLCache
+from src.services.metrics import db_request_seconds, db_errors_total
+from src.services.tracing import span
+from src.services.single_flight import single_flight
+from src.settings import settings
 
 # Initialize Supabase client
 supabase: Client = None
 
+# supabase-py is synchronous, so every .execute() runs in a bounded pool of its own
+# instead of blocking the event loop or competing for the default executor.
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    """Return the dedicated DB executor, creating it on first use"""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.supabase_max_workers,
+            thread_name_prefix="supabase"
+        )
+    return _db_executor
+
+# chat_id -> linked_chats row (or None for chats that are not linked).
+# Every group message is routed through it, so the mapping is cached in-process.
+_linked_chat_cache = TTLCache(
+    max_size=settings.routing_cache_max_size,
+    ttl=settings.routing_cache_ttl
+)
+# team_id -> teams row, read on every Q&A turn for name and system_message.
+# Writes below go through it, so it never serves a stale system message.
+_team_cache = TTLCache(
+    max_size=settings.team_cache_max_size,
+    ttl=settings.team_cache_ttl
+)
+# team_id -> recent daily_summaries rows for the prompt prefix, change once a day
+_summary_cache = TTLCache(
+    max_size=settings.team_cache_max_size,
+    ttl=settings.prompt_summary_cache_ttl
+)
+_MISSING = object()
+
+async def _execute(query, function: str):
+    """
+    Execute a prepared supabase-py query without blocking the event loop.
+    The round-trip time is recorded (and traced) under `function`, the name of
+    the calling supabase_client function.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        with db_request_seconds.time(function=function), span(f"db.{function}"):
+            return await loop.run_in_executor(_get_db_executor(), query.execute)
+    except Exception:
+        db_errors_total.inc(function=function)
+        raise
+
+@single_flight()
 async def get_team_by_id(team_id: str) -> Optional[Dict]:
-    """Get team document by ID"""
+    """Get team document by ID (cached)"""
+    cached = _team_cache.get(team_id)
+    if cached is not None:
+        return cached
     try:
-        result = supabase.table("teams").select("*").eq("id", team_id).execute()
+        result = await _execute(supabase.table("teams").select("*").eq("id", team_id), "get_team_by_id")
         if result.data:
+            _team_cache.set(team_id, result.data[0])
             return result.data[0]
         return None
     except Exception as e:
         logging.error(f"Error getting team {team_id}: {e}")
         return None
 
+@single_flight()
 async def get_teams_by_user(user_id: int) -> List[Dict]:
     """Get all teams where user is a member"""
     try:
-        result = supabase.table("team_members").select("""
+        result = await _execute(supabase.table("team_members").select("""
             teams (
                 id,
                 name,
                 description,
                 created_at
             )
-        """).eq("user_id", user_id).execute()
+        """).eq("user_id", user_id), "get_teams_by_user")
         
         teams = []
         if result.data:
@@ -53,13 +114,14 @@ async def create_team(name: str, description: str, creator_id: int, system_messa
         if system_message:
             team_data["system_message"] = system_message
             
-        team_result = supabase.table("teams").insert(team_data).execute()
+        team_result = await _execute(supabase.table("teams").insert(team_data), "create_team")
         
         if not team_result.data:
             logging.error("Failed to create team - no data returned")
             return None
             
         team_id = team_result.data[0]['id']
+        _team_cache.set(team_id, team_result.data[0])
         
         # Add creator as team member
         member_data = {
@@ -68,7 +130,7 @@ async def create_team(name: str, description: str, creator_id: int, system_messa
             "role": "owner"
         }
         
-        member_result = supabase.table("team_members").insert(member_data).execute()
+        member_result = await _execute(supabase.table("team_members").insert(member_data), "create_team")
         
         if not member_result.data:
             logging.error(f"Failed to add creator as team member for team {team_id}")
@@ -85,16 +147,17 @@ async def update_team_system_message(team_id: str, system_message: str, user_id:
     """Update team's system message (only for team members)"""
     try:
         # Check if user is team member
-        member_check = supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id).execute()
+        member_check = await _execute(supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id), "update_team_system_message")
         
         if not member_check.data:
             logging.warning(f"User {user_id} is not a member of team {team_id}")
             return False
         
         # Update system message
-        result = supabase.table("teams").update({"system_message": system_message}).eq("id", team_id).execute()
+        result = await _execute(supabase.table("teams").update({"system_message": system_message}).eq("id", team_id), "update_team_system_message")
         
         if result.data:
+            _team_cache.set(team_id, result.data[0])
             logging.info(f"Updated system message for team {team_id} by user {user_id}")
             return True
         return False
@@ -107,16 +170,19 @@ async def delete_team(team_id: str, user_id: int) -> bool:
     """Delete team (only for team owners)"""
     try:
         # Check if user is team owner
-        owner_check = supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id).eq("role", "owner").execute()
+        owner_check = await _execute(supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id).eq("role", "owner"), "delete_team")
         
         if not owner_check.data:
             logging.warning(f"User {user_id} is not an owner of team {team_id}")
             return False
         
         # Delete team (this should cascade delete members and linked chats)
-        result = supabase.table("teams").delete().eq("id", team_id).execute()
+        result = await _execute(supabase.table("teams").delete().eq("id", team_id), "delete_team")
         
         if result.data:
+            _team_cache.invalidate(team_id)
+            # Linked chats are cascade-deleted with the team
+            _linked_chat_cache.invalidate_where(lambda chat: chat is not None and chat.get("team_id") == team_id)
             logging.info(f"Deleted team {team_id} by owner {user_id}")
             return True
         return False
@@ -129,21 +195,21 @@ async def link_chat_to_team(chat_id: int, chat_title: str, team_id: str, user_id
     """Link a chat to a team (only for team members)"""
     try:
         # Check if user is team member
-        member_check = supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id).execute()
+        member_check = await _execute(supabase.table("team_members").select("role").eq("team_id", team_id).eq("user_id", user_id), "link_chat_to_team")
         
         if not member_check.data:
             logging.warning(f"User {user_id} is not a member of team {team_id}")
             return False
         
         # Check if chat is already linked
-        existing_link = supabase.table("linked_chats").select("*").eq("chat_id", chat_id).execute()
+        existing_link = await _execute(supabase.table("linked_chats").select("*").eq("chat_id", chat_id), "link_chat_to_team")
         
         if existing_link.data:
             # Update existing link
-            result = supabase.table("linked_chats").update({
+            result = await _execute(supabase.table("linked_chats").update({
                 "team_id": team_id,
                 "chat_title": chat_title
-            }).eq("chat_id", chat_id).execute()
+            }).eq("chat_id", chat_id), "link_chat_to_team")
         else:
             # Create new link
             link_data = {
@@ -152,32 +218,41 @@ async def link_chat_to_team(chat_id: int, chat_title: str, team_id: str, user_id
                 "team_id": team_id,
                 "linked_by": user_id
             }
-            result = supabase.table("linked_chats").insert(link_data).execute()
+            result = await _execute(supabase.table("linked_chats").insert(link_data), "link_chat_to_team")
         
         if result.data:
+            _linked_chat_cache.set(chat_id, result.data[0])
             logging.info(f"Linked chat {chat_id} to team {team_id} by user {user_id}")
             return True
+        _linked_chat_cache.invalidate(chat_id)
         return False
         
     except Exception as e:
         logging.error(f"Error linking chat {chat_id} to team {team_id}: {e}")
         return False
 
+@single_flight()
 async def get_linked_chat(chat_id: int) -> Optional[Dict]:
-    """Get linked chat info"""
+    """Get linked chat info (cached, including the "not linked" answer)"""
+    cached = _linked_chat_cache.get(chat_id, _MISSING)
+    if cached is not _MISSING:
+        return cached
     try:
-        result = supabase.table("linked_chats").select("*").eq("chat_id", chat_id).execute()
+        result = await _execute(supabase.table("linked_chats").select("*").eq("chat_id", chat_id), "get_linked_chat")
         if result.data:
+            _linked_chat_cache.set(chat_id, result.data[0])
             return result.data[0]
+        _linked_chat_cache.set(chat_id, None, ttl=settings.routing_cache_negative_ttl)
         return None
     except Exception as e:
         logging.error(f"Error getting linked chat {chat_id}: {e}")
         return None
 
+@single_flight()
 async def get_team_linked_chats(team_id: str) -> List[Dict]:
     """Get all chats linked to a team"""
     try:
-        result = supabase.table("linked_chats").select("*").eq("team_id", team_id).execute()
+        result = await _execute(supabase.table("linked_chats").select("*").eq("team_id", team_id), "get_team_linked_chats")
         return result.data if result.data else []
     except Exception as e:
         logging.error(f"Error getting linked chats for team {team_id}: {e}")
@@ -194,26 +269,192 @@ async def save_message(team_id: str, chat_id: int, message_id: int, user_id: int
             "user_name": user_name,
             "text": text,
         }
-        supabase.table("messages").insert(message_data).execute()
+        await _execute(supabase.table("messages").insert(message_data), "save_message")
         logging.info(f"Saved message from user {user_id} in chat {chat_id} to team {team_id}")
     except Exception as e:
         logging.error(f"Error saving message: {e}")
         # We don't re-raise here to not break the bot on a single message save failure
         pass
 
+# Postgres error of ON CONFLICT without a matching unique constraint
+NO_UNIQUE_CONSTRAINT = "42P10"
+# False once the database turned out to lack UNIQUE(chat_id, message_id)
+_messages_upsert_supported = True
+
+async def save_messages(messages: List[Dict[str, Any]]) -> bool:
+    """
+    Save a batch of messages in one request, skipping already stored ones.
+    Skipping needs UNIQUE(chat_id, message_id) on messages (see MIGRATION_GUIDE.md);
+    without it batches fall back to a plain insert, so a retried batch may
+    store duplicates instead of being lost.
+    """
+    global _messages_upsert_supported
+    if not messages:
+        return True
+    try:
+        if _messages_upsert_supported:
+            try:
+                await _execute(supabase.table("messages").upsert(
+                    messages,
+                    on_conflict="chat_id,message_id",
+                    ignore_duplicates=True
+                ), "save_messages")
+            except APIError as e:
+                if e.code != NO_UNIQUE_CONSTRAINT:
+                    raise
+                _messages_upsert_supported = False
+                logging.error(
+                    "❌ messages has no UNIQUE(chat_id, message_id) constraint, saving batches with plain "
+                    "inserts (retried batches may be duplicated). Add it as described in MIGRATION_GUIDE.md"
+                )
+        if not _messages_upsert_supported:
+            await _execute(supabase.table("messages").insert(messages), "save_messages")
+        logging.info(f"Saved batch of {len(messages)} messages")
+        return True
+    except Exception as e:
+        logging.error(f"Error saving batch of {len(messages)} messages: {e}")
+        return False
+
+@single_flight()
 async def search_messages_by_text(team_id: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
     """Search for messages using full-text search"""
     try:
         # 'websearch_to_tsquery' is generally better for user-provided search terms
-        result = supabase.rpc(
+        result = await _execute(supabase.rpc(
             "match_messages",
             {"team_id_filter": team_id, "query": query, "match_limit": limit}
-        ).execute()
+        ), "search_messages_by_text")
         return result.data if result.data else []
     except Exception as e:
         logging.error(f"Error searching messages: {e}")
         return []
 
+async def get_messages_in_windows(team_id: str, windows: List[Tuple[int, int, int]]) -> List[Dict[str, Any]]:
+    """
+    Fetch the messages of several (chat_id, first_message_id, last_message_id)
+    windows in one request, ordered by chat and message id
+    """
+    if not windows:
+        return []
+    ranges = ",".join(
+        f"and(chat_id.eq.{chat_id},message_id.gte.{first_id},message_id.lte.{last_id})"
+        for chat_id, first_id, last_id in windows
+    )
+    try:
+        result = await _execute(
+            supabase.table("messages")
+            .select("*")
+            .eq("team_id", team_id)
+            .or_(ranges)
+            .order("chat_id")
+            .order("message_id"),
+            "get_messages_in_windows",
+        )
+        return result.data if result.data else []
+    except Exception as e:
+        logging.error(f"Error fetching message windows for team {team_id}: {e}")
+        return []
+
+@single_flight()
+async def get_all_team_ids() -> List[str]:
+    """IDs of every team"""
+    try:
+        result = await _execute(supabase.table("teams").select("id"), "get_all_team_ids")
+        return [row["id"] for row in result.data] if result.data else []
+    except Exception as e:
+        logging.error(f"Error getting teams: {e}")
+        return []
+
+async def get_messages_between(team_id: str, start: str, end: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+    """Messages of a team with start <= created_at < end (ISO timestamps), oldest first"""
+    messages = []
+    offset = 0
+    while True:
+        result = await _execute(
+            supabase.table("messages")
+            .select("*")
+            .eq("team_id", team_id)
+            .gte("created_at", start)
+            .lt("created_at", end)
+            .order("created_at")
+            .range(offset, offset + page_size - 1),
+            "get_messages_between",
+        )
+        page = result.data or []
+        messages.extend(page)
+        if len(page) < page_size:
+            return messages
+        offset += page_size
+
+async def get_summarized_dates(team_id: str, since: str) -> List[str]:
+    """Dates (YYYY-MM-DD) from `since` on that already have a daily summary"""
+    result = await _execute(
+        supabase.table("daily_summaries").select("date").eq("team_id", team_id).gte("date", since),
+        "get_summarized_dates",
+    )
+    return [row["date"] for row in result.data] if result.data else []
+
+async def save_daily_summary(team_id: str, date: str, summary: str, message_count: int) -> bool:
+    """Store the summary of one team day, replacing an earlier one"""
+    try:
+        await _execute(supabase.table("daily_summaries").upsert(
+            {"team_id": team_id, "date": date, "summary": summary, "activity_level": message_count},
+            on_conflict="team_id,date"
+        ), "save_daily_summary")
+        _summary_cache.invalidate(team_id)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving daily summary of team {team_id} for {date}: {e}")
+        return False
+
+@single_flight()
+async def get_recent_summaries(team_id: str) -> List[Dict[str, Any]]:
+    """The last PROMPT_SUMMARY_DAYS daily summaries of a team, oldest first (cached)"""
+    cached = _summary_cache.get(team_id)
+    if cached is not None:
+        return cached
+    try:
+        result = await _execute(
+            supabase.table("daily_summaries")
+            .select("team_id, date, summary")
+            .eq("team_id", team_id)
+            .order("date", desc=True)
+            .limit(settings.prompt_summary_days),
+            "get_recent_summaries",
+        )
+        rows = list(reversed(result.data)) if result.data else []
+        _summary_cache.set(team_id, rows)
+        return rows
+    except Exception as e:
+        logging.error(f"Error getting daily summaries of team {team_id}: {e}")
+        return []
+
+async def get_fsm_record(key: str) -> Optional[Dict[str, Any]]:
+    """FSM state row {"key", "state", "data", "updated_at"} of a storage key"""
+    result = await _execute(supabase.table("fsm_states").select("*").eq("key", key), "get_fsm_record")
+    return result.data[0] if result.data else None
+
+async def save_fsm_records(records: List[Dict[str, Any]]) -> None:
+    """Upsert FSM state rows in one request"""
+    if records:
+        await _execute(supabase.table("fsm_states").upsert(records, on_conflict="key"), "save_fsm_records")
+
+async def delete_fsm_records(keys: List[str]) -> None:
+    if keys:
+        await _execute(supabase.table("fsm_states").delete().in_("key", keys), "delete_fsm_records")
+
+async def purge_fsm_records(updated_before: float) -> None:
+    """Delete FSM states not touched since the given unix time"""
+    await _execute(supabase.table("fsm_states").delete().lt("updated_at", updated_before), "purge_fsm_records")
+
+def get_routing_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the chat -> team routing cache"""
+    return _linked_chat_cache.stats()
+
+def get_team_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the team metadata cache"""
+    return _team_cache.stats()
+
 def init_supabase(url: str, key: str):
     """Initialize Supabase client"""
     global supabase
@@ -222,4 +463,12 @@ def init_supabase(url: str, key: str):
         logging.info("✅ Supabase client initialized successfully")
     except Exception as e:
         logging.error(f"❌ Failed to initialize Supabase client: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+def close_supabase():
+    """Shut down the DB executor, waiting for in-flight queries to finish"""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+        logging.info("✅ Supabase executor shut down")
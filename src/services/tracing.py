@@ -0,0 +1,287 @@
+import logging
+import asyncio
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
+
+from src.settings import settings
+
+# A streamed answer edits the Telegram message many times, keep the tree readable
+MAX_SPANS_PER_TRACE = 200
+
+
+class Span:
+    """One timed step of a trace"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Trace:
+    """One Q&A turn: the root span and every span opened while it ran"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = secrets.token_hex(16)
+        self.started_at = time.time()
+        self.started_ns = time.time_ns()
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = [self.root]
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def attributes(self) -> Dict[str, Any]:
+        return self.root.attributes
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+    def timeline(self) -> List[Tuple[int, float, Span]]:
+        """(depth, start offset in seconds, span) in tree order, children by start time"""
+        children: Dict[Optional[str], List[Span]] = {}
+        for span in self.spans[1:]:
+            children.setdefault(span.parent_id, []).append(span)
+
+        result: List[Tuple[int, float, Span]] = []
+
+        def walk(span: Span, depth: int):
+            result.append((depth, span.start - self.root.start, span))
+            for child in sorted(children.get(span.span_id, ()), key=lambda s: s.start):
+                walk(child, depth + 1)
+
+        walk(self.root, 0)
+        return result
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def start_trace(name: str, **attributes) -> Iterator[Optional[Trace]]:
+    """
+    Trace the block; spans opened inside it (also in tasks it starts) become
+    part of the trace. The finished trace goes to trace_store and, when
+    OTLP_TRACES_ENDPOINT is set, to the collector.
+    """
+    if not settings.tracing_enabled:
+        yield None
+        return
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace.root.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace_store.add(trace)
+        if trace_exporter is not None:
+            trace_exporter.submit(trace)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span; a no-op outside a trace"""
+    trace = _current_trace.get()
+    if trace is None or len(trace.spans) >= MAX_SPANS_PER_TRACE:
+        yield None
+        return
+    parent = _current_span.get() or trace.root
+    current = Span(name, parent.span_id, attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+class TraceStore:
+    """The most recent finished traces, oldest dropped first"""
+
+    def __init__(self, max_traces: int):
+        self._traces: Deque[Trace] = deque(maxlen=max(1, max_traces))
+        self.recorded = 0
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    def add(self, trace: Trace):
+        self._traces.append(trace)
+        self.recorded += 1
+
+    def slowest(self, n: int = 5, team_ids: Optional[Iterable[str]] = None) -> List[Trace]:
+        traces: Iterable[Trace] = self._traces
+        if team_ids is not None:
+            allowed = set(team_ids)
+            traces = [trace for trace in traces if trace.attributes.get("team_id") in allowed]
+        return sorted(traces, key=lambda trace: trace.duration, reverse=True)[:n]
+
+    def clear(self):
+        self._traces.clear()
+
+
+trace_store = TraceStore(settings.trace_store_size)
+
+
+# --- OTLP export -------------------------------------------------------------
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace: Trace, span: Span) -> Dict[str, Any]:
+    start_ns = trace.started_ns + int((span.start - trace.root.start) * 1e9)
+    data = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(span.duration * 1e9)),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+def otlp_payload(traces: List[Trace], service_name: str) -> Dict[str, Any]:
+    """Traces as an OTLP/HTTP JSON ExportTraceServiceRequest"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "chatcopilot"},
+                "spans": [_otlp_span(trace, span) for trace in traces for span in trace.spans],
+            }],
+        }],
+    }
+
+
+class OTLPExporter:
+    """
+    Sends finished traces to an OpenTelemetry collector (OTLP/HTTP, JSON)
+    in batches every `interval` seconds. Traces are diagnostics: when the
+    collector is down a batch is dropped, not retried.
+    """
+
+    def __init__(self, endpoint: str, service_name: str, interval: float = 2.0, max_queue: int = 1000):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.interval = interval
+        self._queue: Deque[Trace] = deque(maxlen=max_queue)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.exported = 0
+        self.dropped = 0
+
+    def submit(self, trace: Trace):
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(trace)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._client = httpx.AsyncClient(timeout=5.0)
+        self._task = asyncio.create_task(self._run(), name="otlp-trace-export")
+        logging.info(f"✅ Exporting traces to {self.endpoint}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._queue or self._client is None:
+            return
+        batch = list(self._queue)
+        self._queue.clear()
+        try:
+            response = await self._client.post(self.endpoint, json=otlp_payload(batch, self.service_name))
+            response.raise_for_status()
+            self.exported += len(batch)
+        except httpx.HTTPError as e:
+            self.dropped += len(batch)
+            logging.warning(f"⚠️ Failed to export {len(batch)} traces to {self.endpoint}: {e}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        await self._client.aclose()
+        self._client = None
+
+
+trace_exporter: Optional[OTLPExporter] = None
+
+
+def start_trace_exporter():
+    """Start the OTLP exporter if OTLP_TRACES_ENDPOINT is set"""
+    global trace_exporter
+    if not settings.tracing_enabled or not settings.otlp_traces_endpoint or trace_exporter is not None:
+        return
+    trace_exporter = OTLPExporter(settings.otlp_traces_endpoint, settings.otlp_service_name)
+    trace_exporter.start()
+
+
+async def stop_trace_exporter():
+    """Send the traces still queued and stop the exporter"""
+    global trace_exporter
+    if trace_exporter is not None:
+        await trace_exporter.stop()
+        trace_exporter = None
@@ -1,62 +1,92 @@
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
 import logging
 import uuid
 import asyncio
 
+from src.services.embedding_backends import load_embedding_backend
+from src.services.embedding_engine import EmbeddingEngine
+from src.services.single_flight import single_flight
+from src.services.embedding_model import EmbeddingModelManager
+from src.services.vector_store import VectorStore
 from src.settings import settings
 
-# Initialize local embedding model
-try:
-    # Используем многоязычную модель для русского языка
-    embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
-    logging.info("✅ Local embedding model loaded successfully")
-except Exception as e:
-    logging.error(f"❌ Failed to load embedding model: {e}")
-    embedding_model = None
+# Используем многоязычную модель для русского языка
+EMBEDDING_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
 
-# Initialize Pinecone (ОТКЛЮЧЕНО)
-# pc = Pinecone(api_key=settings.pinecone_api_key.get_secret_value())
-# pinecone_index = pc.Index(host=settings.pinecone_host)
+def _load_embedding_model():
+    # Бэкенд (torch, torch-int8, onnx, onnx-int8) выбирается через EMBEDDING_BACKEND
+    return load_embedding_backend(
+        settings.embedding_backend,
+        EMBEDDING_MODEL_NAME,
+        onnx_file=settings.embedding_onnx_file
+    )
 
+# Модель загружается лениво (при первом запросе) или прогревается в фоне из main.py
+embedding_model_manager = EmbeddingModelManager(
+    _load_embedding_model,
+    f"{EMBEDDING_MODEL_NAME} [{settings.embedding_backend}]"
+)
 
+def _encode_batch(texts: list):
+    return embedding_model_manager.model.encode(texts, batch_size=len(texts))
+
+# Конкурентные запросы эмбеддингов объединяются в батчи и считаются в отдельном потоке
+embedding_engine = EmbeddingEngine(
+    _encode_batch,
+    max_batch_size=settings.embedding_max_batch_size,
+    max_wait_ms=settings.embedding_max_wait_ms
+)
+
+# Локальное векторное хранилище вместо Pinecone (namespace на команду, файлы на диске)
+vector_store = VectorStore(settings.vector_store_path)
+
+
+@single_flight()
 async def get_embedding(text: str, model="local"):
     """
     Создает эмбеддинг для текста используя локальную модель
     """
-    if embedding_model is None:
-        raise Exception("Embedding model not loaded")
+    await embedding_model_manager.wait_ready(timeout=settings.embedding_ready_timeout)
     
     try:
         # Очищаем текст
         text = text.replace("\n", " ").strip()
         
-        # Создаем эмбеддинг в отдельном потоке (модель синхронная)
-        loop = asyncio.get_event_loop()
-        embedding = await loop.run_in_executor(None, embedding_model.encode, text)
-        
-        # Возвращаем как список
-        return embedding.tolist()
+        # Эмбеддинг считается в общем батче с другими конкурентными запросами
+        return await embedding_engine.embed(text)
         
     except Exception as e:
         logging.error(f"❌ Failed to create embedding: {e}")
         raise e
 
+async def get_embeddings(texts: list) -> list:
+    """
+    Создает эмбеддинги для списка текстов (порядок сохраняется)
+    """
+    await embedding_model_manager.wait_ready(timeout=settings.embedding_ready_timeout)
+    
+    try:
+        texts = [text.replace("\n", " ").strip() for text in texts]
+        return await embedding_engine.embed_many(texts)
+        
+    except Exception as e:
+        logging.error(f"❌ Failed to create embeddings for {len(texts)} texts: {e}")
+        raise e
+
+def _namespace(team_id: str) -> str:
+    return f"team-{team_id}"
+
 def upsert_vector(vector_id: str, vector: list, team_id: str, text: str):
-    """Upsert vector to Pinecone with team namespace"""
-    namespace = f"team-{team_id}"
+    """Upsert vector to the local vector store with team namespace"""
+    namespace = _namespace(team_id)
     
     try:
         logging.info(f"Upserting vector {vector_id} to namespace: {namespace}")
         
-        pinecone_index.upsert(
-            vectors=[{
-                "id": vector_id,
-                "values": vector,
-                "metadata": {"text": text}
-            }],
-            namespace=namespace
-        )
+        vector_store.namespace(namespace).upsert([{
+            "id": vector_id,
+            "values": vector,
+            "text": text
+        }])
         
         logging.info(f"Successfully upserted vector {vector_id} to namespace {namespace}")
         
@@ -64,16 +94,68 @@ def upsert_vector(vector_id: str, vector: list, team_id: str, text: str):
         logging.error(f"Failed to upsert vector {vector_id} to namespace {namespace}: {e}", exc_info=True)
         raise e
 
+def message_vector_id(chat_id: int, message_id: int) -> str:
+    return f"msg-{chat_id}-{message_id}"
+
+async def index_messages(rows: list) -> int:
+    """
+    Индексирует сохраненные сообщения в векторном хранилище команды
+    
+    Векторы сообщений хранят исходную строку в metadata, чтобы гибридный поиск
+    возвращал те же словари, что и полнотекстовый. Повторная индексация того же
+    сообщения заменяет старый вектор.
+    """
+    rows = [row for row in rows if row.get("text", "").strip()]
+    if not rows:
+        return 0
+    vectors = await get_embeddings([row["text"] for row in rows])
+    
+    by_team = {}
+    for row, vector in zip(rows, vectors):
+        by_team.setdefault(row["team_id"], []).append({
+            "id": message_vector_id(row["chat_id"], row["message_id"]),
+            "values": vector,
+            "text": row["text"],
+            "metadata": row
+        })
+    
+    loop = asyncio.get_running_loop()
+    for team_id, items in by_team.items():
+        ns = vector_store.namespace(_namespace(team_id))
+        await loop.run_in_executor(None, ns.upsert, items)
+    return len(rows)
+
+def delete_vectors(team_id: str, vector_ids: list) -> int:
+    """Delete vectors from a team namespace, compacting it when too many rows are dead"""
+    ns = vector_store.namespace(_namespace(team_id))
+    deleted = ns.delete(vector_ids)
+    total_rows = ns.vector_count + ns.dead_count
+    if total_rows and ns.dead_count / total_rows > settings.vector_store_compact_ratio:
+        ns.compact()
+    return deleted
+
+def compact_namespace(team_id: str) -> int:
+    """Drop deleted rows of a team namespace from disk"""
+    return vector_store.namespace(_namespace(team_id)).compact()
+
+async def query_vectors(team_id: str, vector: list, top_k: int = 5) -> list:
+    """
+    Ищет top_k ближайших векторов команды по косинусной близости
+    
+    Returns:
+        Список {"id", "score", "text", "metadata"} по убыванию близости
+    """
+    ns = vector_store.namespace(_namespace(team_id))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, ns.search, vector, top_k)
+
 def get_namespace_stats(team_id: str):
     """Get statistics for a team namespace"""
-    namespace = f"team-{team_id}"
+    namespace = _namespace(team_id)
     
     try:
         logging.info(f"Getting stats for namespace: {namespace}")
-        stats = pinecone_index.describe_index_stats()
-        
-        namespace_stats = stats.get('namespaces', {}).get(namespace, {})
-        vector_count = namespace_stats.get('vector_count', 0)
+        vector_count = vector_store.namespace(namespace).vector_count
         
         logging.info(f"Namespace {namespace} has {vector_count} vectors")
         return {
@@ -102,7 +184,7 @@ async def test_team_vector_creation(team_id: str, test_text: str = "Тестов
         # Create unique ID
         vector_id = f"test-{str(uuid.uuid4())}"
         
-        # Upsert to Pinecone
+        # Upsert to the local vector store
         upsert_vector(vector_id, vector, team_id, test_text)
         
         # Get stats
@@ -135,10 +217,13 @@ async def test_embedding_service():
         
         if len(embedding) > 0:
             logging.info(f"✅ Embedding created successfully! Size: {len(embedding)}")
+            model_stats = embedding_model_manager.stats()
             return {
                 'success': True,
                 'embedding_size': len(embedding),
-                'model': 'paraphrase-multilingual-MiniLM-L12-v2'
+                'model': 'paraphrase-multilingual-MiniLM-L12-v2',
+                'load_time': model_stats['load_time'],
+                'rss_delta_mb': model_stats['rss_delta_mb']
             }
         else:
             logging.error("❌ Empty embedding returned")
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import threading
+from typing import Optional, List, Dict, Any, Iterable
+
+import numpy as np
+
+
+class VectorNamespace:
+    """
+    One team namespace on disk: a contiguous float32 matrix plus a metadata log.
+
+    Files in the namespace directory:
+      - vectors.f32 - raw row-major float32 matrix, memory-mapped for search
+      - meta.jsonl  - one JSON line per row ({"id", "text", "metadata"}) and tombstones for deletes
+      - header.json - vector dimension
+
+    Rows are L2-normalized on insert, so cosine similarity is a single dot
+    product over the matrix. Upserting an existing id tombstones the old row;
+    compact() rewrites both files with live rows only.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.dim: Optional[int] = None
+        self._lock = threading.RLock()
+
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._meta_path = os.path.join(path, "meta.jsonl")
+        self._header_path = os.path.join(path, "header.json")
+
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        self._alive: List[bool] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._alive_mask: Optional[np.ndarray] = None
+
+        self._load()
+
+    # --- loading -----------------------------------------------------------
+
+    def _load(self):
+        if os.path.exists(self._header_path):
+            with open(self._header_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.exists(self._meta_path):
+            self._read_meta()
+        if self.dim:
+            self._repair_vectors()
+
+    def _read_meta(self):
+        with open(self._meta_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("deleted"):
+                    row = self._row_by_id.pop(record["id"], None)
+                    if row is not None:
+                        self._alive[row] = False
+                    continue
+                previous = self._row_by_id.get(record["id"])
+                if previous is not None:
+                    self._alive[previous] = False
+                self._row_by_id[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._texts.append(record.get("text", ""))
+                self._metadata.append(record.get("metadata"))
+                self._alive.append(True)
+
+    def _repair_vectors(self):
+        """
+        upsert() appends to vectors.f32 first and to meta.jsonl second, so a
+        crash in between leaves vector rows without metadata (or a partial
+        row). They are cut off, otherwise every later row would be paired with
+        the wrong id. Metadata rows without a vector are dropped as well, also
+        from meta.jsonl, or the next upsert would be paired with them on restart.
+        """
+        row_bytes = 4 * self.dim
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        rows = min(size // row_bytes, len(self._ids))
+        if size > rows * row_bytes:
+            logging.warning(
+                f"Vector namespace {self.name}: {(size - rows * row_bytes) / row_bytes:.2f} vector rows "
+                f"without metadata on disk, truncating them"
+            )
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(rows * row_bytes)
+        if rows < len(self._ids):
+            logging.warning(
+                f"Vector namespace {self.name}: {len(self._ids) - rows} rows missing on disk, ignoring them"
+            )
+            for row in range(rows, len(self._ids)):
+                if self._row_by_id.get(self._ids[row]) == row:
+                    del self._row_by_id[self._ids[row]]
+            del self._ids[rows:], self._texts[rows:], self._alive[rows:]
+            del self._metadata[rows:]
+            self._rewrite_meta()
+
+    def _rewrite_meta(self):
+        """Write meta.jsonl from memory: one line per row, then tombstones of deleted ids"""
+        tmp_meta = self._meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            for row, vector_id in enumerate(self._ids):
+                f.write(json.dumps(self._record(vector_id, self._texts[row], self._metadata[row]), ensure_ascii=False) + "\n")
+            for vector_id in dict.fromkeys(self._ids):
+                if vector_id not in self._row_by_id:
+                    f.write(json.dumps({"id": vector_id, "deleted": True}) + "\n")
+        os.replace(tmp_meta, self._meta_path)
+
+    def _matrix_view(self) -> Optional[np.ndarray]:
+        """Memory-mapped matrix, remapped when rows were appended"""
+        rows = len(self._ids)
+        if rows == 0:
+            return None
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._alive_mask = None
+        if self._alive_mask is None:
+            self._alive_mask = np.asarray(self._alive, dtype=bool)
+        return self._matrix
+
+    # --- writes ------------------------------------------------------------
+
+    @staticmethod
+    def _record(vector_id: str, text: str, metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        record = {"id": vector_id, "text": text}
+        if metadata:
+            record["metadata"] = metadata
+        return record
+
+    def upsert(self, items: Iterable[Dict[str, Any]]):
+        """Add or replace vectors; each item is {"id", "values", "text"} plus optional "metadata" """
+        items = list(items)
+        if not items:
+            return
+        matrix = np.asarray([item["values"] for item in items], dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("vectors must be one-dimensional and of equal length")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                os.makedirs(self.path, exist_ok=True)
+                with open(self._header_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"vector dimension {matrix.shape[1]} does not match namespace dimension {self.dim}")
+
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            with open(self._meta_path, "a", encoding="utf-8") as f:
+                for item in items:
+                    f.write(json.dumps(self._record(item["id"], item.get("text", ""), item.get("metadata")), ensure_ascii=False) + "\n")
+
+            for item in items:
+                previous = self._row_by_id.get(item["id"])
+                if previous is not None:
+                    self._alive[previous] = False
+                self._row_by_id[item["id"]] = len(self._ids)
+                self._ids.append(item["id"])
+                self._texts.append(item.get("text", ""))
+                self._metadata.append(item.get("metadata"))
+                self._alive.append(True)
+            self._alive_mask = None
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Tombstone vectors by id, returns how many were deleted"""
+        with self._lock:
+            deleted = [vector_id for vector_id in ids if vector_id in self._row_by_id]
+            if not deleted:
+                return 0
+            with open(self._meta_path, "a", encoding="utf-8") as f:
+                for vector_id in deleted:
+                    f.write(json.dumps({"id": vector_id, "deleted": True}) + "\n")
+                    self._alive[self._row_by_id.pop(vector_id)] = False
+            self._alive_mask = None
+            return len(deleted)
+
+    def compact(self) -> int:
+        """Rewrite the namespace with live rows only, returns how many rows were dropped"""
+        with self._lock:
+            matrix = self._matrix_view()
+            if matrix is None:
+                return 0
+            live_rows = [row for row, alive in enumerate(self._alive) if alive]
+            dropped = len(self._ids) - len(live_rows)
+            if dropped == 0:
+                return 0
+
+            live_matrix = np.ascontiguousarray(matrix[live_rows])
+            tmp_vectors = self._vectors_path + ".tmp"
+            tmp_meta = self._meta_path + ".tmp"
+            with open(tmp_vectors, "wb") as f:
+                f.write(live_matrix.tobytes())
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                for row in live_rows:
+                    f.write(json.dumps(self._record(self._ids[row], self._texts[row], self._metadata[row]), ensure_ascii=False) + "\n")
+
+            self._matrix = None
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_meta, self._meta_path)
+
+            self._ids = [self._ids[row] for row in live_rows]
+            self._texts = [self._texts[row] for row in live_rows]
+            self._metadata = [self._metadata[row] for row in live_rows]
+            self._alive = [True] * len(live_rows)
+            self._row_by_id = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._alive_mask = None
+            logging.info(f"Compacted vector namespace {self.name}: dropped {dropped} rows")
+            return dropped
+
+    # --- reads -------------------------------------------------------------
+
+    def search(self, vector, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Cosine top-k over live rows"""
+        with self._lock:
+            matrix = self._matrix_view()
+            if matrix is None or top_k <= 0:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+            scores = matrix @ (query / norm)
+            scores[~self._alive_mask] = -np.inf
+
+            k = min(top_k, len(self._row_by_id))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {"id": self._ids[row], "score": float(scores[row]), "text": self._texts[row], "metadata": self._metadata[row]}
+                for row in top
+            ]
+
+    @property
+    def vector_count(self) -> int:
+        return len(self._row_by_id)
+
+    @property
+    def dead_count(self) -> int:
+        return len(self._ids) - len(self._row_by_id)
+
+
+class VectorStore:
+    """Directory of per-team vector namespaces"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._namespaces: Dict[str, VectorNamespace] = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, name: str) -> VectorNamespace:
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = VectorNamespace(os.path.join(self.root, name), name)
+                self._namespaces[name] = ns
+            return ns
+
+    def list_namespaces(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, entry, "meta.jsonl"))
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        namespaces = {name: {"vector_count": self.namespace(name).vector_count} for name in self.list_namespaces()}
+        return {
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values()),
+            "namespaces": namespaces,
+        }
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr
+from typing import Optional
 
 class Settings(BaseSettings):
     bot_token: SecretStr
@@ -10,11 +11,130 @@ class Settings(BaseSettings):
     vllm_max_tokens: int = 2048
     vllm_temperature: float = 0.7
     vllm_timeout: int = 30
+    vllm_connect_timeout: float = 5.0
+    vllm_max_connections: int = 20
+    vllm_max_keepalive_connections: int = 10
+    vllm_keepalive_expiry: float = 30.0
+    vllm_http2: bool = False
+    vllm_streaming: bool = True
+    vllm_api: str = "completions"  # completions | chat (/v1/chat/completions)
+    stream_edit_interval: float = 1.0
+
+    # RAG context packing (token budget for the CONTEXT block of the prompt)
+    vllm_tokenizer: Optional[str] = None
+    context_max_tokens: int = 3000
+    context_message_max_tokens: int = 400
+
+    # Daily team summaries in the stable prefix of the prompt (0 days = off)
+    prompt_summary_days: int = 3
+    prompt_summary_max_tokens: int = 600
+    prompt_summary_cache_ttl: int = 600
+
+    # Answer cache in front of the LLM
+    answer_cache_max_entries: int = 500
+    answer_cache_semantic: bool = True
+    answer_cache_similarity_threshold: float = 0.92
+
+    # Local vector store (replaces Pinecone)
+    vector_store_path: str = "data/vectors"
+    vector_store_compact_ratio: float = 0.3
+
+    # Embedding micro-batching
+    embedding_max_batch_size: int = 32
+    embedding_max_wait_ms: float = 5.0
+    embedding_backend: str = "torch"
+    embedding_onnx_file: Optional[str] = None
+    embedding_warmup: bool = True
+    embedding_ready_timeout: float = 120.0
     
     # Supabase
     supabase_url: str
     supabase_anon_key: SecretStr
     supabase_service_key: SecretStr
+    supabase_max_workers: int = 8
+
+    # Chat -> team routing cache
+    routing_cache_max_size: int = 10000
+    routing_cache_ttl: int = 600
+    routing_cache_negative_ttl: int = 60
+
+    # Team metadata cache
+    team_cache_max_size: int = 1000
+    team_cache_ttl: int = 300
+
+    # Message ingestion (write-behind batching)
+    ingestion_batch_size: int = 50
+    ingestion_flush_interval_ms: int = 500
+    ingestion_queue_max_size: int = 5000
+    ingestion_max_retries: int = 3
+
+    # Hybrid retrieval (full-text + vector)
+    vector_index_messages: bool = True
+    retrieval_fts_timeout: float = 3.0
+    retrieval_vector_timeout: float = 1.5
+    retrieval_candidates: int = 20
+    retrieval_rrf_k: int = 60
+    retrieval_neighbor_window: int = 3
+
+    # Daily team summaries (background scheduler)
+    summary_enabled: bool = True
+    summary_interval_seconds: float = 3600
+    summary_initial_delay_seconds: float = 60
+    summary_backfill_days: int = 1
+    summary_max_concurrency: int = 2
+    summary_chunk_tokens: int = 2500
+    summary_max_tokens: int = 512
+
+    # Hot window of recent team messages (in memory)
+    hot_window_max_messages: int = 200
+    hot_window_hours: float = 6
+    hot_window_max_mb: int = 64
+
+    # Update delivery: polling | webhook (python main.py --mode webhook)
+    bot_mode: str = "polling"
+    webhook_url: Optional[str] = None
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080  # 8000 is the default vLLM port
+    webhook_secret: Optional[SecretStr] = None
+    webhook_shutdown_timeout: float = 30.0
+
+    # FSM storage: memory | sqlite | supabase (sqlite/supabase survive restarts
+    # and can be shared by several bot processes)
+    fsm_storage: str = "memory"
+    fsm_sqlite_path: str = "data/fsm.sqlite3"
+    fsm_cache_ttl: float = 2.0
+    fsm_flush_interval_ms: int = 50
+    fsm_session_ttl: int = 86400
+
+    # vLLM admission control (fair queue per team)
+    llm_max_in_flight: int = 8
+    llm_queue_timeout: float = 30.0
+    llm_background_queue_timeout: float = 0  # 0 = background jobs wait indefinitely
+
+    # vLLM circuit breaker and adaptive timeouts (VLLM_TIMEOUT is the upper bound)
+    llm_breaker_enabled: bool = True
+    llm_breaker_window: int = 20
+    llm_breaker_min_requests: int = 5
+    llm_breaker_error_rate: float = 0.5
+    llm_breaker_consecutive_failures: int = 3
+    llm_breaker_open_seconds: float = 10.0
+    llm_breaker_max_open_seconds: float = 120.0
+    llm_adaptive_timeout: bool = True
+    llm_timeout_p95_multiplier: float = 2.0
+    llm_timeout_min: float = 5.0
+
+    # Prometheus metrics endpoint (GET /metrics), served in both bot modes
+    metrics_enabled: bool = True
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9090
+
+    # Per-turn Q&A traces: kept in memory for /slow_traces, optionally sent to
+    # an OpenTelemetry collector (OTLP/HTTP JSON, e.g. http://localhost:4318/v1/traces)
+    tracing_enabled: bool = True
+    trace_store_size: int = 200
+    otlp_traces_endpoint: Optional[str] = None
+    otlp_service_name: str = "chatcopilot"
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+
+class GracefulRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler that answers Telegram with 200 right away and feeds the
+    update to the dispatcher in a background task. On shutdown it waits for
+    the updates still being handled before closing the bot session.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, shutdown_timeout: float = 30, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.shutdown_timeout = shutdown_timeout
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def close(self) -> None:
+        pending = set(self._background_feed_update_tasks)
+        if pending:
+            logging.info(f"⏳ Waiting for {len(pending)} updates to finish before shutdown")
+            done, not_done = await asyncio.wait(pending, timeout=self.shutdown_timeout)
+            if not_done:
+                logging.warning(f"⚠️ {len(not_done)} updates did not finish in {self.shutdown_timeout}s, cancelling")
+                for task in not_done:
+                    task.cancel()
+                await asyncio.gather(*not_done, return_exceptions=True)
+        await super().close()
+
+
+def create_webhook_app(
+    bot: Bot,
+    dp: Dispatcher,
+    path: str,
+    secret_token: str,
+    shutdown_timeout: float = 30,
+) -> web.Application:
+    """aiohttp application serving Telegram updates on `path`"""
+    app = web.Application()
+    handler = GracefulRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        shutdown_timeout=shutdown_timeout,
+    )
+    handler.register(app, path=path)
+    # Runs dp.startup / dp.shutdown together with the web app
+    setup_application(app, dp, bot=bot)
+    app["webhook_handler"] = handler
+    return app
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Тест конкурентности слоя доступа к данным и single-flight (без Supabase и vLLM)
+"""
+
+import asyncio
+import sys
+import os
+import time
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Заглушки для обязательных настроек, чтобы скрипт работал без .env
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test")
+
+from src.services import supabase_client, vector_db, llm
+
+DB_LATENCY = 0.2
+HANDLERS = 8
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """Имитирует построитель запросов supabase-py с блокирующим execute()"""
+
+    executed = 0
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        FakeQuery.executed += 1
+        time.sleep(DB_LATENCY)
+        return FakeResponse(self._data)
+
+
+class FakeSupabase:
+    def table(self, name):
+        return FakeQuery([{"chat_id": 1, "team_id": "team-1"}])
+
+    def rpc(self, name, params):
+        return FakeQuery([])
+
+
+async def heartbeat(stop: asyncio.Event) -> int:
+    """Считает тики event loop'а, пока идут запросы к БД"""
+    ticks = 0
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        ticks += 1
+    return ticks
+
+
+async def test_overlap():
+    print("\n🔀 Запросы разных чатов перекрываются...")
+
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        supabase_client.get_linked_chat(chat_id) for chat_id in range(HANDLERS)
+    ])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    ticks = await beat
+
+    serial = DB_LATENCY * HANDLERS
+    print(f"   Обработчиков: {HANDLERS}, задержка БД: {DB_LATENCY}s")
+    print(f"   Время (параллельно): {elapsed:.2f}s")
+    print(f"   Время (последовательно): {serial:.2f}s")
+    print(f"   Тиков event loop во время запросов: {ticks}")
+
+    assert all(results), "Не все обработчики получили ответ"
+    assert elapsed < serial / 2, "Запросы выполнялись последовательно"
+    assert ticks > 0, "Event loop был заблокирован"
+
+    print("   ✅ Запросы перекрываются, event loop не блокируется")
+
+
+async def test_single_flight_supabase():
+    print(f"\n🛬 {HANDLERS} одновременных get_linked_chat одного чата...")
+    supabase_client._linked_chat_cache.clear()
+    FakeQuery.executed = 0
+
+    results = await asyncio.gather(*[supabase_client.get_linked_chat(-100) for _ in range(HANDLERS)])
+
+    print(f"   Запросов в БД: {FakeQuery.executed}")
+    assert all(result == results[0] for result in results), "Обработчики получили разные ответы"
+    assert FakeQuery.executed == 1, f"Ожидался 1 запрос в БД, было {FakeQuery.executed}"
+    print("   ✅ Один запрос на всех")
+
+
+async def test_single_flight_embedding():
+    print(f"\n🛬 {HANDLERS} одновременных get_embedding одного текста...")
+    encoded = []
+
+    class FakeModel:
+        def encode(self, texts, batch_size=None):
+            encoded.extend(texts)
+            time.sleep(0.05)
+            return [[1.0, 0.0] for _ in texts]
+
+    vector_db.embedding_model_manager.model = FakeModel()
+    vector_db.embedding_model_manager.state = "ready"
+
+    results = await asyncio.gather(*[vector_db.get_embedding("Когда релиз?") for _ in range(HANDLERS)])
+
+    print(f"   Текстов посчитано моделью: {len(encoded)}")
+    assert all(result == [1.0, 0.0] for result in results)
+    assert len(encoded) == 1, f"Ожидался 1 текст в модели, было {len(encoded)}"
+    await vector_db.embedding_engine.close()
+    print("   ✅ Один эмбеддинг на всех")
+
+
+async def test_single_flight_answer():
+    print(f"\n🛬 {HANDLERS} одновременных одинаковых вопросов к ИИ...")
+    generations = []
+
+    async def fake_request_answer(parts, team_id=None):
+        generations.append(parts.question)
+        await asyncio.sleep(0.1)
+        return "Релиз в пятницу"
+
+    async def fake_stream_answer(parts, team_id=None):
+        generations.append(parts.question)
+        for token in ["Релиз", " в", " пятницу"]:
+            await asyncio.sleep(0.03)
+            yield token
+
+    llm._request_answer = fake_request_answer
+    llm._stream_answer = fake_stream_answer
+
+    answers = await asyncio.gather(*[
+        llm.get_answer("контекст", "Когда релиз?", team_id="team-1") for _ in range(HANDLERS)
+    ])
+    print(f"   get_answer: генераций {len(generations)}")
+    assert set(answers) == {"Релиз в пятницу"}
+    assert len(generations) == 1, f"Ожидалась 1 генерация, было {len(generations)}"
+
+    generations.clear()
+
+    async def read_stream():
+        return "".join([chunk async for chunk in llm.stream_answer("контекст", "Когда релиз?", team_id="team-1")])
+
+    streamed = await asyncio.gather(*[read_stream() for _ in range(HANDLERS)])
+    print(f"   stream_answer: генераций {len(generations)}")
+    assert set(streamed) == {"Релиз в пятницу"}
+    assert len(generations) == 1, f"Ожидалась 1 генерация, было {len(generations)}"
+
+    # Другой команде ответ не делится
+    generations.clear()
+    await asyncio.gather(
+        llm.get_answer("контекст", "Когда релиз?", team_id="team-1"),
+        llm.get_answer("контекст", "Когда релиз?", team_id="team-2"),
+    )
+    assert len(generations) == 2, "Вопросы разных команд не должны объединяться"
+    print("   ✅ Одна генерация на одинаковые вопросы команды")
+
+
+async def main():
+    print("🔀 Тестирование конкурентности supabase_client и single-flight...")
+    print("=" * 50)
+
+    supabase_client.supabase = FakeSupabase()
+
+    await test_overlap()
+    await test_single_flight_supabase()
+    await test_single_flight_embedding()
+    await test_single_flight_answer()
+
+    supabase_client.close_supabase()
+    print("\n✅ Все проверки пройдены!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
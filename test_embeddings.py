@@ -6,11 +6,112 @@
 import asyncio
 import sys
 import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Добавляем путь к проекту
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from src.services.vector_db import test_embedding_service, get_embedding
+from src.services.vector_db import test_embedding_service, get_embedding, embedding_model_manager, EMBEDDING_MODEL_NAME
+from src.services.embedding_engine import EmbeddingEngine
+from src.services.embedding_backends import EMBEDDING_BACKENDS, load_embedding_backend, cosine_agreement
+from src.services.embedding_model import current_rss_mb
+
+BENCH_TEXTS = 256
+BENCH_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+
+async def benchmark_batch_sizes():
+    """Пропускная способность движка эмбеддингов при разных размерах батча (CPU)"""
+    texts = [f"Сообщение номер {i}: обсуждаем релиз, API и задачи команды" for i in range(BENCH_TEXTS)]
+    embedding_model = await embedding_model_manager.wait_ready()
+    results = {}
+    
+    for batch_size in BENCH_BATCH_SIZES:
+        engine = EmbeddingEngine(
+            lambda batch: embedding_model.encode(batch, batch_size=len(batch)),
+            max_batch_size=batch_size,
+            max_wait_ms=5
+        )
+        # Прогрев
+        await engine.embed("прогрев")
+        
+        start = time.perf_counter()
+        await asyncio.gather(*[engine.embed(text) for text in texts])
+        elapsed = time.perf_counter() - start
+        
+        stats = engine.stats()
+        await engine.close()
+        results[batch_size] = BENCH_TEXTS / elapsed
+        print(f"   batch={batch_size:<3} {results[batch_size]:8.1f} текстов/с  (средний батч {stats['avg_batch_size']:.1f})")
+    
+    return results
+
+
+PROBE_TEXTS = [
+    "Когда релиз?",
+    "Кто отвечает за API?",
+    "Завтра делаем интеграцию фронтенда и бэкенда",
+    "Hello! How are you doing? Working on the project.",
+    "Нужно поднять лимиты на сервере vLLM до пятницы",
+]
+
+
+def measure_backend(backend: str) -> dict:
+    """Замеры одного бэкенда; запускается в отдельном процессе, чтобы RSS не смешивался"""
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    model = load_embedding_backend(backend, EMBEDDING_MODEL_NAME)
+    load_time = time.perf_counter() - start
+    
+    model.encode(["прогрев"], batch_size=1)
+    latencies = []
+    for text in PROBE_TEXTS * 4:
+        start = time.perf_counter()
+        model.encode([text], batch_size=1)
+        latencies.append(time.perf_counter() - start)
+    
+    texts = [f"Сообщение номер {i}: обсуждаем релиз, API и задачи команды" for i in range(BENCH_TEXTS)]
+    start = time.perf_counter()
+    model.encode(texts, batch_size=32)
+    throughput = BENCH_TEXTS / (time.perf_counter() - start)
+    
+    return {
+        "load_time": load_time,
+        "latency_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput": throughput,
+        "rss_mb": current_rss_mb() - rss_before,
+        "probe": model.encode(PROBE_TEXTS, batch_size=len(PROBE_TEXTS)).tolist(),
+    }
+
+
+def benchmark_backends():
+    """Сравнение бэкендов: задержка, пропускная способность, память и совпадение с torch"""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    
+    for backend in EMBEDDING_BACKENDS:
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[backend] = pool.submit(measure_backend, backend).result()
+        except Exception as e:
+            print(f"   {backend:<11} ❌ недоступен: {type(e).__name__}: {e}")
+            continue
+        
+        result = results[backend]
+        agreement = ""
+        if "torch" in results and backend != "torch":
+            cosine = cosine_agreement(results["torch"]["probe"], result["probe"])
+            agreement = f"  cos(torch) mean={cosine['mean']:.4f} min={cosine['min']:.4f}"
+        print(
+            f"   {backend:<11} загрузка {result['load_time']:5.1f}s  "
+            f"задержка {result['latency_ms']:6.1f}ms  "
+            f"{result['throughput']:7.1f} текстов/с  "
+            f"RSS +{result['rss_mb']:.0f} MB{agreement}"
+        )
+    
+    return results
 
 
 async def main():
@@ -25,6 +126,8 @@ async def main():
         print(f"✅ Сервис работает!")
         print(f"   Модель: {result['model']}")
         print(f"   Размер эмбеддинга: {result['embedding_size']}")
+        print(f"   Время загрузки модели: {result['load_time']:.1f}s")
+        print(f"   Память модели (RSS): +{result['rss_delta_mb']:.0f} MB")
     else:
         print(f"❌ Ошибка: {result['error']}")
         return
@@ -70,6 +173,16 @@ async def main():
     except Exception as e:
         print(f"❌ Ошибка с длинным текстом: {e}")
     
+    # 5. Бенчмарк микро-батчинга
+    print(f"\n5️⃣ Пропускная способность по размеру батча ({BENCH_TEXTS} конкурентных запросов)...")
+    results = await benchmark_batch_sizes()
+    speedup = results[BENCH_BATCH_SIZES[-1]] / results[1]
+    print(f"   Ускорение batch={BENCH_BATCH_SIZES[-1]} относительно batch=1: x{speedup:.1f}")
+    
+    # 6. Сравнение бэкендов
+    print("\n6️⃣ Сравнение бэкендов эмбеддингов (каждый в отдельном процессе)...")
+    benchmark_backends()
+    
     print("\n✅ Тестирование завершено!")
 
 
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пула соединений vLLM на локальном фейковом OpenAI-совместимом сервере
+"""
+
+import asyncio
+import json
+import sys
+import os
+import time
+import statistics
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Заглушки для обязательных настроек, чтобы скрипт работал без .env
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test")
+
+import httpx
+from aiohttp import web
+
+from src.services.llm import LLMClient
+
+REQUESTS = 200
+PAYLOAD = {"model": "fake", "prompt": "Привет", "max_tokens": 16}
+
+
+ANSWER_TOKENS = ["Тестовый", " ответ"]
+
+
+async def completions(request: web.Request) -> web.StreamResponse:
+    payload = await request.json()
+    chat = "messages" in payload
+    if not payload.get("stream"):
+        text = "".join(ANSWER_TOKENS)
+        choice = {"message": {"role": "assistant", "content": text}} if chat else {"text": text}
+        return web.json_response({"choices": [choice]})
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for token in ANSWER_TOKENS:
+        choice = {"delta": {"content": token}} if chat else {"text": token}
+        chunk = json.dumps({"choices": [choice]}, ensure_ascii=False)
+        await response.write(f"data: {chunk}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def start_fake_vllm() -> tuple:
+    app = web.Application()
+    app.router.add_post("/v1/completions", completions)
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_get("/health", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def bench_fresh_client(base_url: str) -> list:
+    """Старое поведение: новый AsyncClient на каждый запрос"""
+    latencies = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(f"{base_url}/v1/completions", json=PAYLOAD)
+            response.json()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def bench_pooled_client(base_url: str) -> list:
+    """Новое поведение: один LLMClient с keep-alive"""
+    client = LLMClient(
+        base_url=base_url,
+        timeout=30,
+        connect_timeout=5,
+        max_connections=20,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+    )
+    latencies = []
+    try:
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            response = await client.post_completion(PAYLOAD)
+            response.json()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await client.aclose()
+    return latencies
+
+
+def report(name: str, latencies: list):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"   {name:<22} mean={statistics.mean(ms):6.2f}ms  p50={statistics.median(ms):6.2f}ms  p95={p95:6.2f}ms")
+    return statistics.mean(ms)
+
+
+async def main():
+    print("🔌 Бенчмарк клиента vLLM (фейковый сервер)...")
+    print("=" * 50)
+
+    runner, base_url = await start_fake_vllm()
+    try:
+        print(f"\n   Сервер: {base_url}, запросов: {REQUESTS}\n")
+        fresh = report("Новый клиент/запрос", await bench_fresh_client(base_url))
+        pooled = report("Общий пул (LLMClient)", await bench_pooled_client(base_url))
+    finally:
+        await runner.cleanup()
+
+    print(f"\n✅ Экономия на запрос: {fresh - pooled:.2f}ms ({(1 - pooled / fresh) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест локального векторного хранилища: поиск, удаление, компактация
+и восстановление после падения между записью векторов и метаданных
+"""
+
+import os
+import sys
+import tempfile
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.services.vector_store import VectorNamespace
+
+DIM = 3
+
+
+def item(vector_id: str, values):
+    return {"id": vector_id, "values": values, "text": f"text {vector_id}"}
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+def test_search_and_delete(path: str):
+    print("\n🔍 Поиск, перезапись и удаление...")
+    ns = VectorNamespace(path, "search")
+    ns.upsert([item("a", [1, 0, 0]), item("b", [0, 1, 0]), item("c", [0, 0, 1])])
+    ns.upsert([item("a", [0, 1, 0])])
+    ns.delete(["c"])
+
+    ns = VectorNamespace(path, "search")
+    assert ns.vector_count == 2 and ns.dead_count == 2, (ns.vector_count, ns.dead_count)
+    assert ids(ns.search([0, 0, 1], top_k=5)) != ["c"]
+    assert sorted(ids(ns.search([0, 1, 0], top_k=2))) == ["a", "b"]
+
+    assert ns.compact() == 2
+    ns = VectorNamespace(path, "search")
+    assert ns.vector_count == 2 and ns.dead_count == 0
+    assert sorted(ids(ns.search([0, 1, 0], top_k=2))) == ["a", "b"]
+    print("✅ Удаленные и перезаписанные строки не возвращаются, компактация их убирает")
+
+
+def test_vectors_without_metadata(path: str):
+    print("\n💥 Векторы записаны, метаданные нет...")
+    ns = VectorNamespace(path, "orphan_vectors")
+    ns.upsert([item("a", [1, 0, 0]), item("b", [0, 1, 0])])
+    # Падение после записи вектора "c" (и куска следующего), но до meta.jsonl
+    with open(os.path.join(path, "vectors.f32"), "ab") as f:
+        f.write(b"\x00" * (4 * DIM + 5))
+
+    ns = VectorNamespace(path, "orphan_vectors")
+    ns.upsert([item("c", [0, 0, 1])])
+    ns = VectorNamespace(path, "orphan_vectors")
+    top = ns.search([0, 0, 1], top_k=1)[0]
+    assert top["id"] == "c" and top["score"] > 0.99, top
+    print("✅ Лишние строки векторов обрезаны, новые векторы совпадают со своими id")
+
+
+def test_metadata_without_vectors(path: str):
+    print("\n💥 Метаданные есть, векторов нет...")
+    ns = VectorNamespace(path, "orphan_meta")
+    ns.upsert([item("a", [1, 0, 0]), item("b", [0, 1, 0]), item("c", [0, 0, 1])])
+    ns.delete(["b"])
+    # Файл векторов потерял последнюю строку
+    with open(os.path.join(path, "vectors.f32"), "r+b") as f:
+        f.truncate(4 * DIM * 2)
+
+    ns = VectorNamespace(path, "orphan_meta")
+    assert ns.vector_count == 1, ns.vector_count
+    ns.upsert([item("d", [0, 0, 1])])
+    ns = VectorNamespace(path, "orphan_meta")
+    top = ns.search([0, 0, 1], top_k=1)[0]
+    assert top["id"] == "d" and top["score"] > 0.99, top
+    assert "b" not in ids(ns.search([0, 1, 0], top_k=5))
+    print("✅ Метаданные без векторов удалены и из meta.jsonl, удаления сохранены")
+
+
+def main():
+    print("🗂️ Тестирование локального векторного хранилища...")
+    print("=" * 50)
+
+    with tempfile.TemporaryDirectory() as root:
+        test_search_and_delete(os.path.join(root, "search"))
+        test_vectors_without_metadata(os.path.join(root, "orphan_vectors"))
+        test_metadata_without_vectors(os.path.join(root, "orphan_meta"))
+
+    print("\n" + "=" * 50)
+    print("✅ Все тесты векторного хранилища пройдены")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Локальная проверка webhook-режима: записанные апдейты отправляются POST-запросом
+в webhook-приложение, без Telegram. Меряется время ответа и задержка хендлеров.
+"""
+
+import asyncio
+import copy
+import sys
+import os
+import time
+import statistics
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Заглушки для обязательных настроек, чтобы скрипт работал без .env
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test")
+
+import httpx
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.filters import Command
+from aiogram.types import Message
+from aiohttp.test_utils import TestServer
+
+from src.webhook import create_webhook_app
+
+SECRET = "test-secret"
+PATH = "/webhook"
+UPDATES = 200
+HANDLER_WORK = 0.05  # имитация работы хендлера (запросы в БД, LLM)
+
+# Апдейты в том виде, в котором их присылает Telegram
+RECORDED_UPDATES = [
+    {
+        "update_id": 1,
+        "message": {
+            "message_id": 101,
+            "date": 1760000000,
+            "chat": {"id": -1001234567890, "type": "supergroup", "title": "Команда"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Иван"},
+            "text": "Созвон переносим на завтра в 11:00",
+        },
+    },
+    {
+        "update_id": 2,
+        "message": {
+            "message_id": 7,
+            "date": 1760000005,
+            "chat": {"id": 42, "type": "private", "first_name": "Иван"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Иван"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    },
+]
+
+received_at = {}
+handler_latencies = []
+
+
+def build_dispatcher() -> Dispatcher:
+    router = Router()
+
+    @router.message(Command("start"))
+    @router.message(F.text)
+    async def handle(message: Message):
+        await asyncio.sleep(HANDLER_WORK)
+        handler_latencies.append(time.perf_counter() - received_at.pop(message.message_id))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def recorded_update(n: int) -> dict:
+    update = copy.deepcopy(RECORDED_UPDATES[n % len(RECORDED_UPDATES)])
+    update["update_id"] = n
+    update["message"]["message_id"] = n
+    return update
+
+
+def report(name: str, latencies: list):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"   {name:<22} mean={statistics.mean(ms):6.2f}ms  p50={statistics.median(ms):6.2f}ms  p95={p95:6.2f}ms")
+
+
+async def start_app(dp: Dispatcher, shutdown_timeout: float = 30) -> TestServer:
+    bot = Bot(token="123456:TEST-TOKEN")
+    app = create_webhook_app(bot, dp, path=PATH, secret_token=SECRET, shutdown_timeout=shutdown_timeout)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def test_secret_token():
+    print("\n🔐 Проверка секретного токена...")
+    server = await start_app(build_dispatcher())
+    async with httpx.AsyncClient(base_url=str(server.make_url(""))) as client:
+        wrong = await client.post(PATH, json=recorded_update(0), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+        missing = await client.post(PATH, json=recorded_update(0))
+    await server.close()
+    ok = wrong.status_code == 401 and missing.status_code == 401
+    print(f"   {'✅' if ok else '❌'} Неверный токен: {wrong.status_code}, без токена: {missing.status_code}")
+    return ok
+
+
+async def test_latency():
+    print(f"\n⏱️ {UPDATES} апдейтов, хендлер работает {HANDLER_WORK * 1000:.0f}ms...")
+    server = await start_app(build_dispatcher())
+    response_latencies = []
+    async with httpx.AsyncClient(base_url=str(server.make_url(""))) as client:
+        for n in range(1, UPDATES + 1):
+            received_at[n] = time.perf_counter()
+            started = time.perf_counter()
+            response = await client.post(PATH, json=recorded_update(n), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            response_latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.text
+    await server.close()
+
+    report("HTTP-ответ Telegram", response_latencies)
+    report("Хендлер (до конца)", handler_latencies)
+    ok = len(handler_latencies) == UPDATES and statistics.median(response_latencies) < HANDLER_WORK
+    print(f"   {'✅' if ok else '❌'} Ответ отправляется до окончания обработки, обработано {len(handler_latencies)}/{UPDATES}")
+    return ok
+
+
+async def test_graceful_shutdown():
+    print("\n🛑 Остановка с апдейтами в обработке...")
+    handler_latencies.clear()
+    server = await start_app(build_dispatcher())
+    async with httpx.AsyncClient(base_url=str(server.make_url(""))) as client:
+        for n in range(1, 21):
+            received_at[n] = time.perf_counter()
+            await client.post(PATH, json=recorded_update(n), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+    in_flight = server.app["webhook_handler"].in_flight
+    await server.close()
+    ok = len(handler_latencies) == 20
+    print(f"   {'✅' if ok else '❌'} В обработке при остановке: {in_flight}, завершено: {len(handler_latencies)}/20")
+    return ok
+
+
+async def main():
+    print("🌐 Проверка webhook-режима (без Telegram)...")
+    print("=" * 50)
+    results = [await test_secret_token(), await test_latency(), await test_graceful_shutdown()]
+    print("\n" + "=" * 50)
+    print("✅ Все проверки пройдены" if all(results) else "❌ Есть ошибки")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)